@@ -0,0 +1,118 @@
+import math
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from blackjack_evaluation import play_hand, worker_seeds
+
+
+def spread_bet(true_count, counts=(1, 2, 3, 4), bets=(1, 2, 4, 6, 8)):
+    """Bet for the true count: bets[i] between counts[i - 1] and counts[i]
+    Works on arrays of true counts, use functools.partial to set the spread
+    """
+    return np.asarray(bets, dtype=float)[np.digitize(true_count, counts)]
+
+
+def play_shoe(env, act):
+    """Play hands until the shoe is reshuffled, returns arrays of the true
+    count before every hand (the one the bet is placed on) and its reward
+    """
+    env.reset_deck()
+    counts, rewards = [], []
+    while True:
+        count, cursor = env.shoe.true_count(), env.shoe.cursor
+        _, reward = play_hand(env, act)
+        counts.append(count)
+        rewards.append(reward)
+        # Shoe is over at the cut card or if it was reshuffled during the hand
+        if len(env.shoe) < env.shuffle_on or env.shoe.cursor < cursor:
+            return np.array(counts), np.array(rewards)
+
+
+def play_bankroll(counts, rewards, shoe_ends, bet, bankroll):
+    """Bankroll of one trial with the bet spread, played over precomputed hands
+    Returns bankroll at the end of every shoe (constant after ruin), number of
+    hands played, their total / squared profit, total bet and ruin flag.
+    The player is ruined when the bankroll can not cover the next bet.
+    """
+    wagers = bet(counts)
+    profits = wagers * rewards
+    before = bankroll + np.concatenate(([0.0], np.cumsum(profits)[:-1]))
+
+    broke = np.flatnonzero(before < wagers)
+    n_hands = broke[0] if len(broke) else len(wagers)
+    profits, wagers = profits[:n_hands], wagers[:n_hands]
+
+    history = bankroll + np.concatenate(([0.0], np.cumsum(profits)))
+    trajectory = history[np.minimum(shoe_ends, n_hands)]
+    return trajectory, int(n_hands), profits.sum(), (profits ** 2).sum(), wagers.sum(), len(broke) > 0
+
+
+def _simulate_shard(args):
+    make_env, policy, spreads, seeds, n_shoes, bankroll = args
+    env = make_env()
+    act = policy.__getitem__ if isinstance(policy, dict) else policy
+
+    results = {name: [] for name in spreads}
+    for seed in seeds:
+        env.seed(seed)
+        shoes = [play_shoe(env, act) for _ in range(n_shoes)]
+        counts = np.concatenate([count for count, _ in shoes])
+        rewards = np.concatenate([reward for _, reward in shoes])
+        # Number of hands played before the end of every shoe (0 for the start)
+        shoe_ends = np.cumsum([0] + [len(reward) for _, reward in shoes])
+
+        # Hands do not depend on the bet, so all spreads are played on the same cards
+        for name, bet in spreads.items():
+            results[name].append(play_bankroll(counts, rewards, shoe_ends, bet, bankroll))
+    return results
+
+
+def simulate_bankroll(make_env, policy, spreads, n_trials, n_shoes, bankroll,
+                      hands_per_hour=100, n_workers=None, seed=None):
+    """Bankroll simulation of bet spreads sharded over a process pool
+    make_env - picklable callable, which creates a counting env (env class or
+    functools.partial, e.g. with dealer_bucket for the cached dealer modes)
+    policy - dict from observation to action or picklable callable obs -> action
+    spreads - dict from name to picklable bet function of the true count
+    (works on arrays, see spread_bet)
+    Every trial plays n_shoes shoes starting with bankroll, every worker plays
+    its share of trials with an independent seed per trial.
+    Returns for every spread EV and standard deviation per hand and per hour,
+    mean bet, risk of ruin and bankroll trajectories (trial x shoe). Per hand
+    statistics are nan for a spread that played no hands (every trial ruined
+    before the first hand).
+    """
+    if n_trials <= 0:
+        raise ValueError(f'n_trials must be positive, got {n_trials}')
+    n_workers = min(n_workers or os.cpu_count(), n_trials)
+    seeds = worker_seeds(seed, n_trials)
+    tasks = [(make_env, policy, spreads, seeds[i::n_workers], n_shoes, bankroll) for i in range(n_workers)]
+
+    with Pool(n_workers) as pool:
+        shards = pool.map(_simulate_shard, tasks)
+
+    stats = {}
+    for name in spreads:
+        trials = [trial for shard in shards for trial in shard[name]]
+        trajectories, n_hands, totals, squares, wagers, ruined = zip(*trials)
+
+        n_hands = int(sum(n_hands))
+        if n_hands:
+            ev = float(sum(totals)) / n_hands
+            std = math.sqrt(max(sum(squares) / n_hands - ev ** 2, 0.0))
+            mean_bet = float(sum(wagers)) / n_hands
+        else:
+            ev = std = mean_bet = math.nan
+        stats[name] = {
+            'ev_per_hand': ev,
+            'std_per_hand': std,
+            'hourly_ev': ev * hands_per_hour,
+            'hourly_std': std * math.sqrt(hands_per_hour),
+            'mean_bet': mean_bet,
+            'risk_of_ruin': sum(ruined) / n_trials,
+            'n_hands': n_hands,
+            'trajectories': np.array(trajectories),
+        }
+    return stats
@@ -0,0 +1,95 @@
+from functools import lru_cache
+
+import numpy as np
+
+from blackjack_shoe import deck
+
+# Dealer final totals: 17, 18, 19, 20, 21 and bust (stored as 22)
+dealer_totals = np.array([17, 18, 19, 20, 21, 22])
+
+# Probabilities of cards in the infinite deck (index by card value)
+infinite_probs = tuple(np.bincount(deck, minlength=11) / len(deck))
+
+
+def hand_value(total, ace):  # Hand total from the sum of cards (aces as 1) and ace flag
+    return total + 10 if ace and total + 10 <= 21 else total
+
+
+@lru_cache(maxsize=4096)
+def dealer_outcomes(total, ace, probs):
+    """Probabilities of dealer final totals (17..21, bust) for the dealer hand
+    with sum of cards total (aces as 1), which draws until 17 or greater.
+    Cards are drawn with fixed probabilities probs (index by card value).
+    The result is cached, so it is returned read-only
+    """
+    value = hand_value(total, ace)
+    outcomes = np.zeros(len(dealer_totals))
+    if value >= 17:
+        outcomes[min(value, 22) - 17] = 1.0
+    else:
+        for card in range(1, 11):
+            if probs[card] > 0:
+                outcomes += probs[card] * dealer_outcomes(total + card, ace or card == 1, probs)
+    outcomes.setflags(write=False)
+    return outcomes
+
+
+def dealer_table(probs):
+    """Distributions of dealer final totals for all dealer hands at once:
+    table[total, ace] for the sum of cards total (aces as 1) and ace flag.
+    Cards are drawn with fixed probabilities probs (index by card value)
+    """
+    probs = np.asarray(probs)
+    table = np.zeros((32, 2, len(dealer_totals)))
+    for total in range(31, 0, -1):
+        for ace in (1, 0):
+            value = hand_value(total, ace)
+            if value >= 17:
+                table[total, ace, min(value, 22) - 17] = 1.0
+            else:
+                table[total, ace] = probs[1] * table[total + 1, 1] + probs[2:] @ table[total + 2:total + 11, ace]
+    return table
+
+
+def bucket_counts(rank_counts, bucket=1):  # Round counts of the shoe to multiples of bucket
+    counts = tuple(bucket * int(round(x / bucket)) for x in rank_counts)
+    if sum(counts[1:]) == 0:
+        # Nothing left after rounding, use exact composition
+        return tuple(int(x) for x in rank_counts)
+    return counts
+
+
+@lru_cache(maxsize=4096)
+def shoe_table(counts):  # Cached dealer_table for the shoe composition
+    if counts is None:
+        return dealer_table(infinite_probs)
+    counts = np.asarray(counts, dtype=float)
+    return dealer_table(counts / counts[1:].sum())
+
+
+def dealer_distribution(dealer, rank_counts=None, bucket=1):
+    """Probabilities of dealer final totals (17..21, bust) for the dealer hand
+    (list of cards, e.g. [upcard] or both dealer cards)
+    rank_counts - cards left in the shoe (index by card value as in
+    Shoe.rank_counts), None for the infinite deck. The composition is not
+    depleted by the dealer's own draws. Counts are rounded to multiples of
+    bucket, so that close shoe compositions share the cache.
+    """
+    counts = None if rank_counts is None else bucket_counts(rank_counts, bucket)
+    return shoe_table(counts)[sum(dealer), int(1 in dealer)]
+
+
+def sample_dealer_score(distribution, np_random):  # Dealer score (0 if bust) sampled in one draw
+    index = np.searchsorted(np.cumsum(distribution), np_random.uniform(), side='right')
+    total = dealer_totals[min(index, len(dealer_totals) - 1)]
+    return 0 if total > 21 else int(total)
+
+
+def win_lose(player_score, distribution):
+    """Probabilities to win and to lose with player_score against the dealer,
+    comparing scores like cmp(score(player), score(dealer)) (0 if bust)
+    """
+    dealer_scores = np.where(dealer_totals > 21, 0, dealer_totals)
+    win = distribution[dealer_scores < player_score].sum()
+    lose = distribution[dealer_scores > player_score].sum()
+    return win, lose
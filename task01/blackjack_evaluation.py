@@ -0,0 +1,76 @@
+import math
+import os
+from collections import defaultdict
+from multiprocessing import Pool
+from statistics import NormalDist
+
+import numpy as np
+
+
+def play_hand(env, act):  # Play one hand, return the first observation and the final reward
+    obs = env.reset()
+    first_obs, done = obs, False
+    while not done:
+        obs, reward, done, _ = env.step(act(obs))
+    # The split envs return the total reward of both hands on the last step
+    return first_obs, reward
+
+
+def worker_seeds(seed, n_workers):  # Independent seeds for the workers
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(n_workers)]
+
+
+def _evaluate_shard(args):
+    make_env, policy, n_hands, seed = args
+    env = make_env()
+    env.seed(seed)
+
+    act = policy.__getitem__ if isinstance(policy, dict) else policy
+
+    # Sums of returns (and their squares) and number of hands per first observation
+    sums, squares, counts = defaultdict(float), defaultdict(float), defaultdict(int)
+    for _ in range(n_hands):
+        state, reward = play_hand(env, act)
+        sums[state] += reward
+        squares[state] += reward ** 2
+        counts[state] += 1
+    return sums, squares, counts
+
+
+def evaluate_policy(make_env, policy, n_hands, n_workers=None, seed=None, confidence=0.95):
+    """Monte Carlo evaluation of the policy sharded over a process pool
+    make_env - picklable callable, which creates the env (env class or functools.partial)
+    policy - dict from observation to action or picklable callable obs -> action
+    Every worker plays its share of n_hands on its own env with an independent seed.
+    Returns mean return per hand, its standard error and confidence interval,
+    and mean return with number of hands for every first observation.
+    """
+    if n_hands <= 0:
+        raise ValueError(f'n_hands must be positive, got {n_hands}')
+    n_workers = min(n_workers or os.cpu_count(), n_hands)
+    shards = [n_hands // n_workers + (i < n_hands % n_workers) for i in range(n_workers)]
+    tasks = [(make_env, policy, n, seed) for n, seed in zip(shards, worker_seeds(seed, n_workers)) if n > 0]
+
+    with Pool(len(tasks)) as pool:
+        results = pool.map(_evaluate_shard, tasks)
+
+    # Merge statistics of the workers
+    sums, squares, counts = defaultdict(float), defaultdict(float), defaultdict(int)
+    for shard_sums, shard_squares, shard_counts in results:
+        for state, count in shard_counts.items():
+            sums[state] += shard_sums[state]
+            squares[state] += shard_squares[state]
+            counts[state] += count
+
+    total, total_squares = sum(sums.values()), sum(squares.values())
+    mean = total / n_hands
+    std = math.sqrt(max(total_squares / n_hands - mean ** 2, 0.0))
+    stderr = std / math.sqrt(n_hands)
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return {
+        'mean': mean,
+        'stderr': stderr,
+        'ci': (mean - z * stderr, mean + z * stderr),
+        'n_hands': n_hands,
+        'states': {state: (sums[state] / count, count) for state, count in counts.items()},
+    }
@@ -0,0 +1,51 @@
+import numpy as np
+
+from gym.utils import seeding
+
+
+class QTable:
+    """Tabular Q-function stored in a NumPy array of shape (n_states, n_actions)
+    States are dense int indices (see encode_obs of the envs), so a batch of
+    states is an int array and selection / updates run without dict lookups.
+    action_mask (bool array broadcastable to q[states]) marks the available
+    actions, e.g. split only when it is possible.
+    """
+    def __init__(self, n_states, n_actions, init=0.0):
+        self.q = np.full((n_states, n_actions), init, dtype=float)
+        self.seed()
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def __getitem__(self, states):
+        return self.q[states]
+
+    def greedy(self, states, action_mask=None):
+        q = self.q[states]
+        if action_mask is not None:
+            q = np.where(action_mask, q, -np.inf)
+        return np.argmax(q, axis=-1)
+
+    def epsilon_greedy(self, states, eps, action_mask=None):
+        greedy = self.greedy(states, action_mask)
+
+        # Random available action: argmax of random scores over the available actions
+        scores = self.np_random.uniform(size=np.shape(states) + (self.q.shape[1],))
+        if action_mask is not None:
+            scores = np.where(action_mask, scores, -1.0)
+        random = np.argmax(scores, axis=-1)
+
+        explore = self.np_random.uniform(size=np.shape(states)) < eps
+        return np.where(explore, random, greedy)
+
+    def update(self, states, actions, rewards, next_states, dones, alpha, gamma=1.0, next_action_mask=None):
+        # Q-learning update for a batch of transitions, returns TD errors
+        next_q = self.q[next_states]
+        if next_action_mask is not None:
+            next_q = np.where(next_action_mask, next_q, -np.inf)
+        target = rewards + gamma * np.where(dones, 0.0, np.max(next_q, axis=-1))
+        td = target - self.q[states, actions]
+        # Repeated (state, action) pairs in the batch accumulate their updates
+        np.add.at(self.q, (states, actions), alpha * td)
+        return td
@@ -0,0 +1,94 @@
+import math
+from collections import deque
+
+import numpy as np
+from gym.utils import seeding
+
+# 1 = Ace, 2-10 = Number cards, Jack/Queen/King = 10
+deck = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10]
+
+# Counting systems, weight of every card is stored by its value (index 0 is unused)
+halves = (0, -1, 0.5, 1, 1, 1.5, 1, 0.5, 0, -0.5, -1)
+hi_opt_1 = (0, 0, 0, 1, 1, 1, 1, 0, 0, 0, -1)
+hi_opt_2 = (0, 0, 1, 1, 2, 2, 1, 1, 0, 0, -2)
+count_systems = {'halves': halves, 'hi_opt_1': hi_opt_1, 'hi_opt_2': hi_opt_2}
+
+
+def count_weights(count_system):  # Weights of the counting system by name or given weights
+    return count_systems[count_system] if isinstance(count_system, str) else tuple(count_system)
+
+
+class Shoe:
+    """Shoe of several decks with an incremental running count
+    The shoe is a pre-shuffled list of cards with a cursor, so drawing a card
+    is O(1). Counts of remaining cards per rank (rank_counts[card]) and the
+    running count of observed cards are updated on every draw / observe, so
+    reading the true count is O(1) as well.
+    Reshuffle builds a new permutation of the shoe without the cards that are
+    still in play (one NumPy call per shoe).
+    All randomness comes from np_random (the env generator, or a new seeded
+    RandomState of the shoe if it is not given, never the global NumPy one),
+    shoes can also be shuffled in bulk ahead of time with pregenerate or
+    replayed with queue.
+    """
+    def __init__(self, num_decks=6, weights=halves, np_random=None):
+        self.num_decks = num_decks
+        self.weights = weights
+        if np_random is None:
+            np_random, _ = seeding.np_random()
+        self.np_random = np_random
+
+        # Number of cards of every rank in a full shoe
+        self.full_counts = np.bincount(deck * 4 * num_decks, minlength=11)
+
+        # Shuffled shoes to use on the next reshuffles
+        self.queued = deque()
+
+        self.shuffle()
+
+    def __len__(self):
+        return len(self.cards) - self.cursor
+
+    def pregenerate(self, n_shoes):
+        # Shuffle n_shoes full shoes ahead of time (row per shoe) and queue them
+        cards = np.repeat(np.arange(11), self.full_counts)
+        shoes = np.array([self.np_random.permutation(cards) for _ in range(n_shoes)]).reshape(n_shoes, len(cards))
+        self.queue(shoes)
+        return shoes
+
+    def queue(self, shoes):
+        # Use given full shoes (e.g. saved from pregenerate) on the next reshuffles,
+        # env.reset_deck() starts the first of them right away
+        self.queued.extend(np.asarray(shoes))
+
+    def shuffle(self, in_play=()):
+        # Return all cards except the ones in play to the shoe
+        counts = self.full_counts.copy()
+        for card in in_play:
+            counts[card] -= 1
+
+        if self.queued:
+            # Take the next queued shoe without the cards in play
+            cards = self.queued.popleft()
+            keep = np.ones(len(cards), dtype=bool)
+            for card in in_play:
+                keep[np.flatnonzero(keep & (cards == card))[0]] = False
+            self.cards = cards[keep].tolist()
+        else:
+            self.cards = self.np_random.permutation(np.repeat(np.arange(11), counts)).tolist()
+        self.cursor = 0
+        self.rank_counts = counts.tolist()
+        self.count = 0.0
+
+    def draw(self):
+        card = self.cards[self.cursor]
+        self.cursor += 1
+        self.rank_counts[card] -= 1
+        return card
+
+    def observe(self, card):
+        # Add card, which was seen by the player, to the running count
+        self.count += self.weights[card]
+
+    def true_count(self):
+        return self.count / math.ceil(len(self) / 52)
@@ -0,0 +1,121 @@
+from functools import lru_cache
+
+import numpy as np
+
+from blackjack_shoe import deck
+from blackjack_dealer import dealer_totals, dealer_outcomes, hand_value
+
+# Actions of the environments: stick, hit, double, split
+STICK, HIT, DOUBLE, SPLIT = 0, 1, 2, 3
+
+
+def card_probs(rank_counts=None):  # Probability to draw every card value (index 0 is unused)
+    if rank_counts is None:
+        # Infinite deck (drawing with replacement from deck)
+        rank_counts = np.bincount(deck, minlength=11)
+    rank_counts = np.asarray(rank_counts, dtype=float)
+    return tuple(rank_counts / rank_counts[1:].sum())
+
+
+# Caches are keyed by the card probabilities, so they are bounded like shoe_table: one shoe
+# composition takes a few hundred entries and old compositions are evicted when solving per shoe
+@lru_cache(maxsize=4096)
+def ev_stick(total, ace, upcard, probs):  # Expected reward of stick with the hand
+    value = hand_value(total, ace)
+    outcomes = dealer_outcomes(upcard, upcard == 1, probs)
+    win = outcomes[(dealer_totals < value) | (dealer_totals > 21)].sum()
+    lose = outcomes[(dealer_totals > value) & (dealer_totals <= 21)].sum()
+    return win - lose
+
+
+@lru_cache(maxsize=4096)
+def ev_hit(total, ace, upcard, probs):  # Expected reward of hit and optimal play after it
+    ev = 0.0
+    for card in range(1, 11):
+        if probs[card] > 0:
+            new_total, new_ace = total + card, ace or card == 1
+            if hand_value(new_total, new_ace) > 21:
+                ev -= probs[card]
+            else:
+                ev += probs[card] * ev_best(new_total, new_ace, upcard, probs)
+    return ev
+
+
+@lru_cache(maxsize=4096)
+def ev_double(total, ace, upcard, probs):  # Expected reward of double (one card and stick)
+    ev = 0.0
+    for card in range(1, 11):
+        if probs[card] > 0:
+            new_total, new_ace = total + card, ace or card == 1
+            if hand_value(new_total, new_ace) > 21:
+                ev -= probs[card]
+            else:
+                ev += probs[card] * ev_stick(new_total, new_ace, upcard, probs)
+    return 2 * ev
+
+
+def ev_best(total, ace, upcard, probs):  # Expected reward of optimal play without split
+    return max(
+        ev_stick(total, ace, upcard, probs),
+        ev_hit(total, ace, upcard, probs),
+        ev_double(total, ace, upcard, probs)
+    )
+
+
+@lru_cache(maxsize=4096)
+def ev_split(card, upcard, probs):
+    """Expected reward of split of a pair of cards: every hand gets one more
+    card and then is played optimally without further splits
+    """
+    ev = 0.0
+    for second in range(1, 11):
+        if probs[second] > 0:
+            ev += probs[second] * ev_best(card + second, card == 1 or second == 1, upcard, probs)
+    return 2 * ev
+
+
+def solve(rank_counts=None):
+    """Exact expected rewards of all actions for every state of the player
+    rank_counts - number of cards of every value left in the shoe (index by card
+    value as in Shoe.rank_counts), None for the infinite deck. The dealer
+    upcard is removed from the shoe, other cards are drawn from the same
+    composition (the state does not tell which cards the player holds).
+    Returns policy and q tables keyed by (player sum, dealer card, usable ace,
+    split possible). q holds rewards of stick, hit, double and split (-inf if
+    split is not possible), policy holds the best action.
+    """
+    policy, q = {}, {}
+    for upcard in range(1, 11):
+        if rank_counts is None:
+            probs = card_probs()
+        else:
+            counts = np.array(rank_counts, dtype=float)
+            counts[upcard] -= 1
+            probs = card_probs(counts)
+
+        # Hard hands and soft hands (with usable ace)
+        hands = [(value, False, value) for value in range(4, 22)]
+        hands += [(value, True, value - 10) for value in range(12, 22)]
+        for value, ace, total in hands:
+            state = (value, upcard, ace, False)
+            q[state] = np.array([
+                ev_stick(total, ace, upcard, probs),
+                ev_hit(total, ace, upcard, probs),
+                ev_double(total, ace, upcard, probs),
+                -np.inf
+            ])
+
+        # Pairs, which can be split
+        for card in range(1, 11):
+            total, ace = 2 * card, card == 1
+            state = (hand_value(total, ace), upcard, ace, True)
+            q[state] = np.array([
+                ev_stick(total, ace, upcard, probs),
+                ev_hit(total, ace, upcard, probs),
+                ev_double(total, ace, upcard, probs),
+                ev_split(card, upcard, probs)
+            ])
+
+    for state, values in q.items():
+        policy[state] = int(np.argmax(values))
+    return policy, q
@@ -1,7 +1,11 @@
+import numpy as np
+
 import gym
 from gym import spaces
 from gym.utils import seeding
 
+from blackjack_dealer import dealer_distribution, sample_dealer_score, win_lose
+
 def cmp(a, b):
     return float(a > b) - float(a < b)
 
@@ -64,7 +68,7 @@ class BlackjackDoubleEnv(gym.Env):
     by Sutton and Barto.
     http://incompleteideas.net/book/the-book-2nd.html
     """
-    def __init__(self, natural=False):
+    def __init__(self, natural=False, dealer_mode='draw'):
         self.action_space = spaces.Discrete(3)
         self.observation_space = spaces.Tuple((
             spaces.Discrete(32),
@@ -75,6 +79,15 @@ class BlackjackDoubleEnv(gym.Env):
         # Flag to payout 1.5 on a "natural" blackjack win, like casino rules
         # Ref: http://www.bicyclecards.com/how-to-play/blackjack/
         self.natural = natural
+
+        # Number of states for encode_obs
+        self.n_states = 32 * 11 * 2
+
+        # How to play out the dealers hand: 'draw' cards one by one, 'sample'
+        # the final total from its distribution or return 'expected' reward
+        assert dealer_mode in ('draw', 'sample', 'expected')
+        self.dealer_mode = dealer_mode
+
         # Start the first game
         self.reset()
 
@@ -94,26 +107,175 @@ class BlackjackDoubleEnv(gym.Env):
                 reward = 0.
         elif action == 0:  # stick: play out the dealers hand, and score
             done = True
-            while sum_hand(self.dealer) < 17:
-                self.dealer.append(draw_card(self.np_random))
-            reward = cmp(score(self.player), score(self.dealer))
-            if self.natural and is_natural(self.player) and reward == 1.:
-                reward = 1.5
+            self.play_dealer()
+            reward = self.compare(self.player)
+            if self.natural and is_natural(self.player) and reward > 0:
+                reward *= 1.5
         else: # double
             self.player.append(draw_card(self.np_random))
             done = True
             if is_bust(self.player):
                 reward = -2.0
             else:
-                while sum_hand(self.dealer) < 17:
-                    self.dealer.append(draw_card(self.np_random))
-                reward = 2 * cmp(score(self.player), score(self.dealer))
+                self.play_dealer()
+                reward = 2 * self.compare(self.player)
         return self._get_obs(), reward, done, {}
 
+    def play_dealer(self):
+        # Play out the dealers hand
+        if self.dealer_mode == 'draw':
+            while sum_hand(self.dealer) < 17:
+                self.dealer.append(draw_card(self.np_random))
+            self.dealer_score = score(self.dealer)
+        else:
+            # Resolve the dealers hand at once with the cached distribution of its final total
+            self.dealer_outcomes = dealer_distribution(self.dealer)
+            if self.dealer_mode == 'sample':
+                self.dealer_score = sample_dealer_score(self.dealer_outcomes, self.np_random)
+
+    def compare(self, hand):
+        # Reward of the hand against the dealer (expected reward in 'expected' mode)
+        if self.dealer_mode == 'expected':
+            win, lose = win_lose(score(hand), self.dealer_outcomes)
+            return win - lose
+        return cmp(score(hand), self.dealer_score)
+
+    def encode_obs(self, obs):
+        # Dense int index of the observation (works for arrays of observations too)
+        player_sum, dealer_card, ace = obs
+        return (player_sum * 11 + dealer_card) * 2 + ace
+
     def _get_obs(self):
         return (sum_hand(self.player), self.dealer[0], usable_ace(self.player))
 
     def reset(self):
         self.dealer = draw_hand(self.np_random)
         self.player = draw_hand(self.np_random)
+        return self._get_obs()
+
+
+class BlackjackDoubleVectorEnv(gym.Env):
+    """Batch of independent BlackjackDoubleEnv games stepped at once
+    Holds N tables as NumPy arrays (player sums, usable aces, dealer cards,
+    done masks), so that one call to step advances every table with the
+    same rules as BlackjackDoubleEnv: stick=0, hit=1, double=2.
+    Hands are stored as the sum of cards (ace counted as 1) plus a flag
+    whether the hand holds an ace, which is all sum_hand and usable_ace need.
+    Tables that are already done ignore their actions and get zero reward
+    until they are reset (see reset(mask)).
+    The observation is a 3-tuple of arrays: the players current sums,
+    the dealer's showing cards and the players usable aces.
+    """
+    def __init__(self, num_envs=1024, natural=False):
+        self.num_envs = num_envs
+        self.action_space = spaces.MultiDiscrete([3] * num_envs)
+        self.observation_space = spaces.Tuple((
+            spaces.MultiDiscrete([32] * num_envs),
+            spaces.MultiDiscrete([11] * num_envs),
+            spaces.MultiBinary(num_envs)))
+        self.seed()
+
+        # Flag to payout 1.5 on a "natural" blackjack win, like casino rules
+        self.natural = natural
+
+        # Number of states for encode_obs
+        self.n_states = 32 * 11 * 2
+
+        # Table state
+        self.player_sum = np.zeros(num_envs, dtype=np.int64)
+        self.player_ace = np.zeros(num_envs, dtype=bool)
+        self.player_natural = np.zeros(num_envs, dtype=bool)
+        self.dealer_card = np.zeros(num_envs, dtype=np.int64)
+        self.dealer_sum = np.zeros(num_envs, dtype=np.int64)
+        self.dealer_ace = np.zeros(num_envs, dtype=bool)
+        self.done = np.ones(num_envs, dtype=bool)
+
+        # Start the first games
+        self.reset()
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def draw_cards(self, n):
+        return self.np_random.choice(deck, size=n)
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        assert actions.shape == (self.num_envs,) and np.all((actions >= 0) & (actions < 3))
+        rewards = np.zeros(self.num_envs)
+        active = ~self.done
+
+        # Hit and double: add a card to players hand
+        draw = active & (actions != 0)
+        cards = self.draw_cards(np.count_nonzero(draw))
+        self.player_sum[draw] += cards
+        self.player_ace[draw] |= cards == 1
+        self.player_natural[draw] = False
+        bust = draw & (self.player_score() > 21)
+
+        hit = active & (actions == 1)
+        double = active & (actions == 2)
+        rewards[hit & bust] = -1.
+        rewards[double & bust] = -2.
+
+        # Stick or double without bust: play out the dealers hands, and score
+        resolve = (active & (actions == 0)) | (double & ~bust)
+        self.play_dealer(resolve)
+        # Score is 0 if bust, like score(hand)
+        player_score, dealer_score = self.player_score(), self.dealer_score()
+        player_score[player_score > 21] = 0
+        dealer_score[dealer_score > 21] = 0
+        outcome = (player_score > dealer_score).astype(float) - (player_score < dealer_score)
+        if self.natural:
+            outcome[self.player_natural & (outcome == 1.)] = 1.5
+        stake = np.where(double, 2., 1.)
+        rewards[resolve] = stake[resolve] * outcome[resolve]
+
+        self.done |= bust | resolve
+        return self._get_obs(), rewards, self.done.copy(), {}
+
+    def play_dealer(self, mask):
+        # Draw cards only for the dealers, which are still below 17
+        playing = mask & (self.dealer_score() < 17)
+        while np.any(playing):
+            cards = self.draw_cards(np.count_nonzero(playing))
+            self.dealer_sum[playing] += cards
+            self.dealer_ace[playing] |= cards == 1
+            playing &= self.dealer_score() < 17
+
+    def player_score(self):
+        return np.where(self.player_ace & (self.player_sum + 10 <= 21), self.player_sum + 10, self.player_sum)
+
+    def dealer_score(self):
+        return np.where(self.dealer_ace & (self.dealer_sum + 10 <= 21), self.dealer_sum + 10, self.dealer_sum)
+
+    def encode_obs(self, obs):
+        # Dense int index of the observation (works for arrays of observations too)
+        player_sum, dealer_card, ace = obs
+        return (player_sum * 11 + dealer_card) * 2 + ace
+
+    def _get_obs(self):
+        return (
+            self.player_score(),
+            self.dealer_card.copy(),
+            self.player_ace & (self.player_sum + 10 <= 21)
+        )
+
+    def reset(self, mask=None):
+        # Reset all tables or only the masked ones (e.g. mask=env.done)
+        mask = np.ones(self.num_envs, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        n = np.count_nonzero(mask)
+
+        dealer = self.draw_cards((n, 2))
+        self.dealer_card[mask] = dealer[:, 0]
+        self.dealer_sum[mask] = dealer.sum(axis=1)
+        self.dealer_ace[mask] = np.any(dealer == 1, axis=1)
+
+        player = self.draw_cards((n, 2))
+        self.player_sum[mask] = player.sum(axis=1)
+        self.player_ace[mask] = np.any(player == 1, axis=1)
+        self.player_natural[mask] = self.player_ace[mask] & (self.player_sum[mask] == 11)
+
+        self.done[mask] = False
         return self._get_obs()
\ No newline at end of file
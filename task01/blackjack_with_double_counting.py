@@ -1,10 +1,12 @@
-import math
 import numpy as np
 
 import gym
 from gym import spaces
 from gym.utils import seeding
 
+from blackjack_shoe import Shoe, count_weights
+from blackjack_dealer import dealer_distribution, sample_dealer_score, win_lose
+
 def cmp(a, b):
     return float(a > b) - float(a < b)
 
@@ -60,7 +62,7 @@ class BlackjackDoubleCountingEnv(gym.Env):
     by Sutton and Barto.
     http://incompleteideas.net/book/the-book-2nd.html
     """
-    def __init__(self, num_decks=6, shuffle_on=15, natural=False):
+    def __init__(self, num_decks=6, shuffle_on=15, natural=False, dealer_mode='draw', dealer_bucket=1, count_bins=(-2.0, -1.0, 0.0, 1.0, 2.0), count_system='halves'):
         self.action_space = spaces.Discrete(3)
         self.observation_space = spaces.Tuple((
             spaces.Discrete(32),
@@ -74,17 +76,32 @@ class BlackjackDoubleCountingEnv(gym.Env):
         # Ref: http://www.bicyclecards.com/how-to-play/blackjack/
         self.natural = natural
         
+        # How to play out the dealers hand: 'draw' cards one by one, 'sample'
+        # the final total from its distribution or return 'expected' reward
+        assert dealer_mode in ('draw', 'sample', 'expected')
+        self.dealer_mode = dealer_mode
+        # Round shoe composition to multiples of dealer_bucket for the cached distributions
+        # (in 'sample' and 'expected' modes dealer hits are not taken from the shoe)
+        self.dealer_bucket = dealer_bucket
+        
         # Number of decks (classic 6 decks)
         self.num_decks = num_decks
         
         # When to shuffle all cards
         self.shuffle_on = shuffle_on
         
-        # Store decks
-        self.deck = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10] * 4 * self.num_decks
+        # Edges of true count bins for encode_obs
+        self.count_bins = np.asarray(count_bins)
+        n_bins = len(self.count_bins) + 1
+        
+        # Number of states for encode_obs
+        self.n_states = 32 * 11 * 2 * n_bins
+        
+        # Card weights of the counting system: 'halves', 'hi_opt_1', 'hi_opt_2' or a tuple by card value
+        self.count_weights = count_weights(count_system)
         
-        # Store current count
-        self.count = 0.0
+        # Store decks and current count
+        self.shoe = Shoe(self.num_decks, weights=self.count_weights, np_random=self.np_random)
         
         # Store information that player
         self.done = False
@@ -93,36 +110,37 @@ class BlackjackDoubleCountingEnv(gym.Env):
 #         self.reset()
         
     def draw_card(self, np_random):
-        # If deck is small, reset deck
-        if len(self.deck) < self.shuffle_on:
-            self.reset_deck()
-            self.count = 0.0
+        # If deck is small, reset deck (shoe is shuffled with self.np_random)
+        if len(self.shoe) < self.shuffle_on:
+            self.reshuffle()
+        return self.shoe.draw()
+    
+    def reshuffle(self):
+        # Shuffle all cards except the ones on the table
+        self.shoe.shuffle(in_play=self.player + self.dealer)
+        
+        # Count player cards
+        for card in self.player:
+            self.shoe.observe(card)
             
-            # Delete player left cards from deck and count
-            for card in self.player:
-                self.deck.pop(self.deck.index(card))
-                self.count += self.halves[card]
+        # Count all previous dealer cards
+        for card in self.dealer[:-1]:
+            self.shoe.observe(card)
             
-            # Delete dealer cards
-            for card in self.dealer:
-                self.deck.pop(self.deck.index(card))
-                
-            # Count all previous dealer cards
-            for card in self.dealer[:-1]:
-                self.count += self.halves[card]
-                
-            # If player is done, we need to count dealer last card
-            if self.done:
-                self.count += self.halves[self.dealer[-1]]
-        
-        card = self.deck.pop(np.random.randint(0, len(self.deck)))
-        return card
+        # If player is done, we need to count dealer last card
+        if self.done:
+            self.shoe.observe(self.dealer[-1])
     
     def draw_hand(self, np_random):
-        return [self.draw_card(np_random), self.draw_card(np.random)]
+        return [self.draw_card(np_random), self.draw_card(np_random)]
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
+        
+        # Shoe shuffles with the env generator, start a new shoe from the seeded one
+        if hasattr(self, 'shoe'):
+            self.shoe.np_random = self.np_random
+            self.reset_deck()
         return [seed]
 
     def step(self, action):
@@ -131,7 +149,7 @@ class BlackjackDoubleCountingEnv(gym.Env):
             # Get player card
             player_card = self.draw_card(self.np_random)
             # Count it
-            self.count += self.halves[player_card]
+            self.shoe.observe(player_card)
             # Memorize it
             self.player.append(player_card)
                                
@@ -140,7 +158,7 @@ class BlackjackDoubleCountingEnv(gym.Env):
                 reward = -1.
                 
                 # Add second dealer card to count
-                self.count += self.halves[self.dealer[1]]
+                self.shoe.observe(self.dealer[1])
             else:
                 self.done = False
                 reward = 0.
@@ -149,84 +167,94 @@ class BlackjackDoubleCountingEnv(gym.Env):
             self.done = True
             
             # Add second dealer card to count
-            self.count += self.halves[self.dealer[1]]
+            self.shoe.observe(self.dealer[1])
             
-            while sum_hand(self.dealer) < 17:
-                # Get dealer card
-                dealer_card = self.draw_card(self.np_random)
-                # Count it
-                self.count += self.halves[dealer_card]
-                # Memorize it
-                self.dealer.append(dealer_card)
+            self.play_dealer()
                 
-            reward = cmp(score(self.player), score(self.dealer))
-            if self.natural and is_natural(self.player) and reward == 1.:
-                reward = 1.5
+            reward = self.compare(self.player)
+            if self.natural and is_natural(self.player) and reward > 0:
+                reward *= 1.5
         else: # double
             # Get player card
             player_card = self.draw_card(self.np_random)
             # Count it
-            self.count += self.halves[player_card]
+            self.shoe.observe(player_card)
             # Memorize it
             self.player.append(player_card)
             
             # Add second dealer card to count
-            self.count += self.halves[self.dealer[1]]
+            self.shoe.observe(self.dealer[1])
             
             self.done = True
             if is_bust(self.player):
                 reward = -2.0
                 
                 # Add second dealer card to count
-                self.count += self.halves[self.dealer[1]]
+                self.shoe.observe(self.dealer[1])
             else:
-                while sum_hand(self.dealer) < 17:
-                    # Get dealer card
-                    dealer_card = self.draw_card(self.np_random)
-                    # Count it
-                    self.count += self.halves[dealer_card]
-                    # Memorize it
-                    self.dealer.append(dealer_card)
+                self.play_dealer()
                     
-                reward = 2 * cmp(score(self.player), score(self.dealer))
+                reward = 2 * self.compare(self.player)
         return self._get_obs(), reward, self.done, {}
 
+    def play_dealer(self):
+        # Play out the dealers hand
+        if self.dealer_mode == 'draw':
+            while sum_hand(self.dealer) < 17:
+                # Get dealer card
+                dealer_card = self.draw_card(self.np_random)
+                # Count it
+                self.shoe.observe(dealer_card)
+                # Memorize it
+                self.dealer.append(dealer_card)
+            self.dealer_score = score(self.dealer)
+        else:
+            # Resolve the dealers hand at once with the cached distribution of its final total
+            self.dealer_outcomes = dealer_distribution(self.dealer, self.shoe.rank_counts, self.dealer_bucket)
+            if self.dealer_mode == 'sample':
+                self.dealer_score = sample_dealer_score(self.dealer_outcomes, self.np_random)
+
+    def compare(self, hand):
+        # Reward of the hand against the dealer (expected reward in 'expected' mode)
+        if self.dealer_mode == 'expected':
+            win, lose = win_lose(score(hand), self.dealer_outcomes)
+            return win - lose
+        return cmp(score(hand), self.dealer_score)
+
+    def encode_obs(self, obs):
+        # Dense int index of the observation with binned true count
+        player_sum, dealer_card, ace, true_count = obs
+        return ((player_sum * 11 + dealer_card) * 2 + ace) * (len(self.count_bins) + 1) + np.digitize(true_count, self.count_bins)
+
     def _get_obs(self):
-        return (sum_hand(self.player), self.dealer[0], usable_ace(self.player), self.count / math.ceil(len(self.deck) / 52))
+        return (sum_hand(self.player), self.dealer[0], usable_ace(self.player), self.shoe.true_count())
 #         return (sum_hand(self.player), self.dealer[0], usable_ace(self.player), self.count)
 
     def reset(self):
         self.done = False
         
-        if len(self.deck) < self.shuffle_on:
+        if len(self.shoe) < self.shuffle_on:
             self.reset_deck()
-            self.count = 0.0
             
         # Draw dealer cards
         self.dealer = self.draw_hand(self.np_random)
-        self.count += self.halves[self.dealer[0]]
+        self.shoe.observe(self.dealer[0])
         
         # Draw player cards
         self.player = self.draw_hand(self.np_random)
-        self.count += self.halves[self.player[0]]
-        self.count += self.halves[self.player[1]]
+        self.shoe.observe(self.player[0])
+        self.shoe.observe(self.player[1])
         
         return self._get_obs()
     
     def reset_deck(self):
-        self.deck = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10] * 4 * self.num_decks
+        self.shoe.shuffle()
         
+    @property
+    def count(self):
+        return self.shoe.count
+    
     @property
     def halves(self):
-        return {
-            1: -1,
-            2: 0.5,
-            3: 1,
-            4: 1,
-            5: 1.5,
-            6: 1,
-            7: 0.5,
-            8: 0,
-            9: -0.5,
-            10: -1
-        }
\ No newline at end of file
+        # Card weights of the count as before the Shoe (for the default system -- Halves)
+        return {card: self.count_weights[card] for card in range(1, 11)}
\ No newline at end of file
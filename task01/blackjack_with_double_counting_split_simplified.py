@@ -1,4 +1,3 @@
-import math
 import random
 import numpy as np
 
@@ -6,6 +5,9 @@ import gym
 from gym import spaces
 from gym.utils import seeding
 
+from blackjack_shoe import Shoe, count_weights
+from blackjack_dealer import dealer_distribution, sample_dealer_score, win_lose
+
 def cmp(a, b):
     return float(a > b) - float(a < b)
 
@@ -61,7 +63,7 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
     by Sutton and Barto.
     http://incompleteideas.net/book/the-book-2nd.html
     """
-    def __init__(self, num_decks=6, shuffle_on=15, natural=False):
+    def __init__(self, num_decks=6, shuffle_on=15, natural=False, dealer_mode='draw', dealer_bucket=1, count_system='halves'):
         self.action_space = spaces.Discrete(4)
         self.observation_space = spaces.Tuple((
             # Left player hand
@@ -87,17 +89,31 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
         # Ref: http://www.bicyclecards.com/how-to-play/blackjack/
         self.natural = natural
         
+        # How to play out the dealers hand: 'draw' cards one by one, 'sample'
+        # the final total from its distribution or return 'expected' reward
+        assert dealer_mode in ('draw', 'sample', 'expected')
+        self.dealer_mode = dealer_mode
+        # Round shoe composition to multiples of dealer_bucket for the cached distributions
+        # (in 'sample' and 'expected' modes dealer hits are not taken from the shoe)
+        self.dealer_bucket = dealer_bucket
+        
         # Number of decks (classic 6 decks)
         self.num_decks = num_decks
         
         # When to shuffle all cards
         self.shuffle_on = shuffle_on
         
-        # Store decks
-        self.deck = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10] * 4 * self.num_decks
+        # Simplified true count has two bins
+        n_bins = 2
+        
+        # Number of states for encode_obs
+        self.n_states = 32 * 2 * 32 * 2 * 11 * 2 * n_bins
         
-        # Store current count
-        self.count = 0.0
+        # Card weights of the counting system: 'halves', 'hi_opt_1', 'hi_opt_2' or a tuple by card value
+        self.count_weights = count_weights(count_system)
+        
+        # Store decks and current count
+        self.shoe = Shoe(self.num_decks, weights=self.count_weights, np_random=self.np_random)
         
         # Player left hand
         self.player_left = None
@@ -119,41 +135,37 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
 #         self.reset()
         
     def draw_card(self, np_random):
-        # If deck is small, reset deck
-        if len(self.deck) < self.shuffle_on:
-            self.reset_deck()
-            self.count = 0.0
-            
-            # Delete player left cards from deck and count
-            for card in self.player_left:
-                self.deck.pop(self.deck.index(card))
-                self.count += self.halves[card]
+        # If deck is small, reset deck (shoe is shuffled with self.np_random)
+        if len(self.shoe) < self.shuffle_on:
+            self.reshuffle()
+        return self.shoe.draw()
+    
+    def reshuffle(self):
+        # Shuffle all cards except the ones on the table
+        self.shoe.shuffle(in_play=self.player_left + self.player_right + self.dealer)
+        
+        # Count player cards
+        for card in self.player_left + self.player_right:
+            self.shoe.observe(card)
             
-            # Delete player right cards from deck and count
-            for card in self.player_right:
-                self.deck.pop(self.deck.index(card))
-                self.count += self.halves[card]
+        # Count all previous dealer cards
+        for card in self.dealer[:-1]:
+            self.shoe.observe(card)
             
-            # Delete dealer cards
-            for card in self.dealer:
-                self.deck.pop(self.deck.index(card))
-                
-            # Count all previous dealer cards
-            for card in self.dealer[:-1]:
-                self.count += self.halves[card]
-                
-            # If player is done, we need to count dealer last card
-            if self.done_left & self.done_right:
-                self.count += self.halves[self.dealer[-1]]
-        
-        card = self.deck.pop(np.random.randint(0, len(self.deck)))
-        return card
+        # If player is done, we need to count dealer last card
+        if self.done_left & self.done_right:
+            self.shoe.observe(self.dealer[-1])
     
     def draw_hand(self, np_random):
-        return [self.draw_card(np_random), self.draw_card(np.random)]
+        return [self.draw_card(np_random), self.draw_card(np_random)]
 
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
+        
+        # Shoe shuffles with the env generator, start a new shoe from the seeded one
+        if hasattr(self, 'shoe'):
+            self.shoe.np_random = self.np_random
+            self.reset_deck()
         return [seed]
 
     def step(self, action):
@@ -166,7 +178,7 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
                 # Get player card
                 player_card = self.draw_card(self.np_random)
                 # Count it
-                self.count += self.halves[player_card]
+                self.shoe.observe(player_card)
                 # Memorize it
                 self.player_left.append(player_card)
                 
@@ -176,7 +188,7 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
                     
                     # Add second dealer card to count if there is no right hand (game end)
                     if self.done_right:
-                        self.count += self.halves[self.dealer[1]]
+                        self.shoe.observe(self.dealer[1])
                 else:
                     self.done_left = False
                     self.reward_left = 0.0
@@ -186,7 +198,7 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
                 # Get player card
                 player_card = self.draw_card(self.np_random)
                 # Count it
-                self.count += self.halves[player_card]
+                self.shoe.observe(player_card)
                 # Memorize it
                 self.player_right.append(player_card)
                 
@@ -195,20 +207,14 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
                     self.reward_right = -1.
                     
                     # Add second dealer card to count (end game with right hand)
-                    self.count += self.halves[self.dealer[1]]
+                    self.shoe.observe(self.dealer[1])
                     
                     # let dealer take cards only if left hand was not bust
                     if self.reward_left < -1e-5:
-                        while sum_hand(self.dealer) < 17:
-                            # Get dealer card
-                            dealer_card = self.draw_card(self.np_random)
-                            # Count it
-                            self.count += self.halves[dealer_card]
-                            # Memorize it
-                            self.dealer.append(dealer_card)
+                        self.play_dealer()
 
                         # Finish left hand
-                        self.reward_left = cmp(score(self.player_left), score(self.dealer))
+                        self.reward_left = self.compare(self.player_left)
                     
                 else:
                     self.done_right = False
@@ -222,44 +228,32 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
                 
                 if self.done_right:
                     # Add second dealer card to count
-                    self.count += self.halves[self.dealer[1]]
+                    self.shoe.observe(self.dealer[1])
                     
-                    while sum_hand(self.dealer) < 17:
-                        # Get dealer card
-                        dealer_card = self.draw_card(self.np_random)
-                        # Count it
-                        self.count += self.halves[dealer_card]
-                        # Memorize it
-                        self.dealer.append(dealer_card)
+                    self.play_dealer()
                         
                     # Finish left hand
-                    self.reward_left = cmp(score(self.player_left), score(self.dealer))
-                    if self.natural and is_natural(self.player_left) and self.reward_left == 1.:
-                        self.reward_left = 1.5
+                    self.reward_left = self.compare(self.player_left)
+                    if self.natural and is_natural(self.player_left) and self.reward_left > 0:
+                        self.reward_left *= 1.5
             
             elif not(self.done_right):
                 self.done_right = True
                 
                 # Add second dealer card to count
-                self.count += self.halves[self.dealer[1]]
+                self.shoe.observe(self.dealer[1])
                 
-                while sum_hand(self.dealer) < 17:
-                    # Get dealer card
-                    dealer_card = self.draw_card(self.np_random)
-                    # Count it
-                    self.count += self.halves[dealer_card]
-                    # Memorize it
-                    self.dealer.append(dealer_card)
+                self.play_dealer()
                     
                 # Finish left hand
-                self.reward_left = cmp(score(self.player_left), score(self.dealer))
-                if self.natural and is_natural(self.player_left) and self.reward_left == 1.:
-                    self.reward_left = 1.5
+                self.reward_left = self.compare(self.player_left)
+                if self.natural and is_natural(self.player_left) and self.reward_left > 0:
+                    self.reward_left *= 1.5
                     
                 # Finish right hand
-                self.reward_right = cmp(score(self.player_right), score(self.dealer))
-                if self.natural and is_natural(self.player_right) and self.reward_right == 1.:
-                    self.reward_right = 1.5
+                self.reward_right = self.compare(self.player_right)
+                if self.natural and is_natural(self.player_right) and self.reward_right > 0:
+                    self.reward_right *= 1.5
             
         elif action == 2: # double
             
@@ -267,7 +261,7 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
                 # Get player card
                 player_card = self.draw_card(self.np_random)
                 # Count it
-                self.count += self.halves[player_card]
+                self.shoe.observe(player_card)
                 # Memorize it
                 self.player_left.append(player_card)
                 
@@ -280,23 +274,17 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
                     
                 if self.done_right:
                     # Add second dealer card to count
-                    self.count += self.halves[self.dealer[1]]
+                    self.shoe.observe(self.dealer[1])
                     
-                    while sum_hand(self.dealer) < 17:
-                        # Get dealer card
-                        dealer_card = self.draw_card(self.np_random)
-                        # Count it
-                        self.count += self.halves[dealer_card]
-                        # Memorize it
-                        self.dealer.append(dealer_card)
+                    self.play_dealer()
                         
-                    self.reward_left = 2 * cmp(score(self.player_left), score(self.dealer))
+                    self.reward_left = 2 * self.compare(self.player_left)
             
             elif not(self.done_right):
                 # Get player card
                 player_card = self.draw_card(self.np_random)
                 # Count it
-                self.count += self.halves[player_card]
+                self.shoe.observe(player_card)
                 # Memorize it
                 self.player_right.append(player_card)
                 
@@ -308,20 +296,14 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
                     self.reward_right = -2.0
                     
                 # Add second dealer card to count
-                self.count += self.halves[self.dealer[1]]
+                self.shoe.observe(self.dealer[1])
                 
-                while sum_hand(self.dealer) < 17:
-                    # Get dealer card
-                    dealer_card = self.draw_card(self.np_random)
-                    # Count it
-                    self.count += self.halves[dealer_card]
-                    # Memorize it
-                    self.dealer.append(dealer_card)
+                self.play_dealer()
                    
                 # Finish left hand
-                self.reward_left = 2 * cmp(score(self.player_left), score(self.dealer))
+                self.reward_left = 2 * self.compare(self.player_left)
                 # Finish right hand
-                self.reward_right = 2 * cmp(score(self.player_right), score(self.dealer))
+                self.reward_right = 2 * self.compare(self.player_right)
                     
         elif action == 3: # split
             # Move second card from left hand to right hand
@@ -329,12 +311,12 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
             
             # Draw card to left hand
             player_card = self.draw_card(self.np_random)
-            self.count += self.halves[player_card]
+            self.shoe.observe(player_card)
             self.player_left.append(player_card)
             
             # Draw card to right hand
             player_card = self.draw_card(self.np_random)
-            self.count += self.halves[player_card]
+            self.shoe.observe(player_card)
             self.player_right.append(player_card)
             
             # Modify action_space
@@ -344,6 +326,38 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
             
         return self._get_obs(), self.reward_left + self.reward_right, self.done_left & self.done_right, {}
 
+    def play_dealer(self):
+        # Play out the dealers hand
+        if self.dealer_mode == 'draw':
+            while sum_hand(self.dealer) < 17:
+                # Get dealer card
+                dealer_card = self.draw_card(self.np_random)
+                # Count it
+                self.shoe.observe(dealer_card)
+                # Memorize it
+                self.dealer.append(dealer_card)
+            self.dealer_score = score(self.dealer)
+        else:
+            # Resolve the dealers hand at once with the cached distribution of its final total
+            self.dealer_outcomes = dealer_distribution(self.dealer, self.shoe.rank_counts, self.dealer_bucket)
+            if self.dealer_mode == 'sample':
+                self.dealer_score = sample_dealer_score(self.dealer_outcomes, self.np_random)
+
+    def compare(self, hand):
+        # Reward of the hand against the dealer (expected reward in 'expected' mode)
+        if self.dealer_mode == 'expected':
+            win, lose = win_lose(score(hand), self.dealer_outcomes)
+            return win - lose
+        return cmp(score(hand), self.dealer_score)
+
+    def encode_obs(self, obs):
+        # Dense int index of the observation (simplified count is already 0 or 1)
+        left_sum, left_ace, right_sum, right_ace, dealer_card, split_possible, positive_count = obs
+        # Busted hands can exceed 31, all of them are the same terminal state
+        left_sum, right_sum = np.minimum(left_sum, 31), np.minimum(right_sum, 31)
+        index = (((left_sum * 2 + left_ace) * 32 + right_sum) * 2 + right_ace) * 11 + dealer_card
+        return (index * 2 + split_possible) * 2 + positive_count
+
     def _get_obs(self):
         return (
             sum_hand(self.player_left),
@@ -353,23 +367,22 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
             self.dealer[0],
             self.split_possible,
             # Simplified real count
-            (self.count / math.ceil(len(self.deck) / 52)) > 0
+            (self.shoe.true_count()) > 0
         )
 
     def reset(self):
-        if len(self.deck) < self.shuffle_on:
+        if len(self.shoe) < self.shuffle_on:
             self.reset_deck()
-            self.count = 0.0
             
         # Draw dealer cards
         self.dealer = self.draw_hand(self.np_random)
-        self.count += self.halves[self.dealer[0]]
+        self.shoe.observe(self.dealer[0])
         
         # Draw player cards
         self.player_left = self.draw_hand(self.np_random)
         self.player_right = []
-        self.count += self.halves[self.player_left[0]]
-        self.count += self.halves[self.player_left[1]]
+        self.shoe.observe(self.player_left[0])
+        self.shoe.observe(self.player_left[1])
         self.done_left = False
         self.done_right = True
         self.reward_left = 0.0
@@ -388,19 +401,13 @@ class BlackjackDoubleCountingSplitSimplifiedEnv(gym.Env):
         return self._get_obs()
     
     def reset_deck(self):
-        self.deck = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10] * 4 * self.num_decks
+        self.shoe.shuffle()
         
+    @property
+    def count(self):
+        return self.shoe.count
+    
     @property
     def halves(self):
-        return {
-            1: -1,
-            2: 0.5,
-            3: 1,
-            4: 1,
-            5: 1.5,
-            6: 1,
-            7: 0.5,
-            8: 0,
-            9: -0.5,
-            10: -1
-        }
\ No newline at end of file
+        # Card weights of the count as before the Shoe (for the default system -- Halves)
+        return {card: self.count_weights[card] for card in range(1, 11)}
\ No newline at end of file
@@ -1,4 +1,7 @@
 import random
+from copy import copy
+from functools import lru_cache
+
 import gym
 import numpy as np
 import matplotlib as mpl
@@ -8,14 +11,177 @@ from gym.utils import seeding
 N_ROWS, N_COLS, N_WIN = 3, 3, 3
 
 
+@lru_cache(maxsize=None)
+def win_masks(n_rows, n_cols, n_win):
+    '''Битовые маски всех линий из n_win клеток подряд (клетке (i, j) соответствует бит i * n_cols + j)'''
+    masks = []
+    for i in range(n_rows):
+        for j in range(n_cols):
+            # Вертикаль, горизонталь и две диагонали, начинающиеся в клетке (i, j)
+            for di, dj in ((1, 0), (0, 1), (1, 1), (1, -1)):
+                end_i, end_j = i + di * (n_win - 1), j + dj * (n_win - 1)
+                if end_i < n_rows and 0 <= end_j < n_cols:
+                    masks.append(sum(1 << ((i + di * k) * n_cols + j + dj * k) for k in range(n_win)))
+    return tuple(masks)
+
+
+@lru_cache(maxsize=None)
+def cell_lines(n_rows, n_cols, n_win):
+    '''Номера линий из win_masks, проходящих через каждую клетку (по номеру клетки i * n_cols + j)'''
+    masks = win_masks(n_rows, n_cols, n_win)
+    return tuple(
+        tuple(k for k, mask in enumerate(masks) if (mask >> cell) & 1)
+        for cell in range(n_rows * n_cols)
+    )
+
+
+@lru_cache(maxsize=None)
+def line_matrix(n_rows, n_cols, n_win):
+    '''Матрица линий win_masks размера (число линий, число клеток): 1 в клетках линии'''
+    masks = win_masks(n_rows, n_cols, n_win)
+    return np.array([[(mask >> cell) & 1 for cell in range(n_rows * n_cols)] for mask in masks], dtype=np.float32)
+
+
+@lru_cache(maxsize=None)
+def zobrist_keys(n_rows, n_cols, seed=0):
+    '''Ключи Zobrist клеток доски (64-битные числа): keys[k] для крестика в клетке k и keys[n_rows * n_cols + k]
+    для нолика, так что хэш доски помещается в uint64. Для досок до 32 клеток ключи линейно независимы
+    над GF(2), поэтому хэш однозначно задает доску; вместе с ключами возвращается базис
+    {старший бит: (вектор, номера ключей)} для обратного преобразования (для больших досок ключи
+    после первых 64 случайные и хэш необратим). Ключи фиксированы для размера доски, так что
+    таблицы с хэшами совместимы между процессами и запусками'''
+    n_keys = 2 * n_rows * n_cols
+    rng = np.random.RandomState(seed)
+    keys, basis = [], {}
+    while len(keys) < n_keys:
+        key = int.from_bytes(rng.bytes(8), 'little')
+        # Исключение Гаусса: добавляем ключ, только если он не выражается через предыдущие
+        vector, combination = key, 1 << len(keys)
+        while vector:
+            pivot = vector.bit_length() - 1
+            if pivot not in basis:
+                basis[pivot] = (vector, combination)
+                keys.append(key)
+                break
+            vector ^= basis[pivot][0]
+            combination ^= basis[pivot][1]
+        else:
+            # Базис из 64 ключей полон -- остальные ключи просто случайные
+            if len(basis) == 64 and key:
+                keys.append(key)
+    return tuple(keys), basis
+
+
+@lru_cache(maxsize=None)
+def symmetries(n_rows, n_cols):
+    '''Симметрии доски (повороты и отражения, 8 для квадратной доски и 4 для прямоугольной):
+    для каждой симметрии перестановка клеток perm[k] -- номер клетки k после преобразования.
+    Нулевая симметрия тождественная'''
+    cells = np.arange(n_rows * n_cols).reshape(n_rows, n_cols)
+    boards = [cells, np.flipud(cells), np.fliplr(cells), np.rot90(cells, 2)]
+    if n_rows == n_cols:
+        boards += [cells.T, np.rot90(cells, 1), np.rot90(cells, 3), np.rot90(cells, 2).T]
+    perms = []
+    for board in boards:
+        perm = np.empty(n_rows * n_cols, dtype=int)
+        perm[board.ravel()] = np.arange(n_rows * n_cols)
+        perms.append(tuple(perm.tolist()))
+    return tuple(perms)
+
+
+@lru_cache(maxsize=None)
+def inverse_symmetries(n_rows, n_cols):
+    '''Обратные перестановки к symmetries: inverse[perm[k]] = k'''
+    return tuple(tuple(np.argsort(perm).tolist()) for perm in symmetries(n_rows, n_cols))
+
+
+@lru_cache(maxsize=None)
+def symmetry_keys(n_rows, n_cols):
+    '''Ключи Zobrist для каждой симметрии: ключ метки в клетке k равен ключу метки в клетке perm[k]'''
+    keys, _ = zobrist_keys(n_rows, n_cols)
+    n_cells = n_rows * n_cols
+    return tuple(
+        tuple(keys[perm[k]] for k in range(n_cells)) + tuple(keys[n_cells + perm[k]] for k in range(n_cells))
+        for perm in symmetries(n_rows, n_cols)
+    )
+
+
+def hash_from_string(board_hash, n_rows, n_cols):
+    '''Zobrist хэш доски по строке getHash (старый формат ключей)'''
+    keys, _ = zobrist_keys(n_rows, n_cols)
+    n_cells = n_rows * n_cols
+    result = 0
+    for cell, x in enumerate(board_hash):
+        if x == '2':
+            result ^= keys[cell]
+        elif x == '0':
+            result ^= keys[n_cells + cell]
+    return result
+
+
+def string_from_hash(zobrist_hash, n_rows, n_cols):
+    '''Строка getHash (старый формат ключей) по Zobrist хэшу доски (для досок до 32 клеток)'''
+    n_cells = n_rows * n_cols
+    if 2 * n_cells > 64:
+        raise ValueError('Хэш доски больше 32 клеток не задает доску однозначно')
+    _, basis = zobrist_keys(n_rows, n_cols)
+    cells = 0
+    while zobrist_hash:
+        vector, combination = basis[zobrist_hash.bit_length() - 1]
+        zobrist_hash ^= vector
+        cells ^= combination
+    return ''.join(
+        '2' if (cells >> cell) & 1 else '0' if (cells >> (n_cells + cell)) & 1 else '1'
+        for cell in range(n_cells)
+    )
+
+
+def convert_state_keys(table, n_rows, n_cols, to_int=True):
+    '''Переводит ключи таблицы (Q-таблицы по getState или state_nodes по getState()[0]) из строк
+    в Zobrist хэши (to_int=True) или обратно, тип таблицы (например, defaultdict) сохраняется'''
+    convert = hash_from_string if to_int else string_from_hash
+    def convert_key(key):
+        if isinstance(key, tuple):
+            return (convert(key[0], n_rows, n_cols),) + key[1:]
+        return convert(key, n_rows, n_cols)
+    result = copy(table)
+    result.clear()
+    for key, value in table.items():
+        result[convert_key(key)] = value
+    return result
+
 
 class TicTacToe(gym.Env):
-    def __init__(self, n_rows=N_ROWS, n_cols=N_COLS, n_win=N_WIN):
+    def __init__(self, n_rows=N_ROWS, n_cols=N_COLS, n_win=N_WIN, int_hash=True, track_symmetries=False):
         self.n_rows = n_rows
         self.n_cols = n_cols
         self.n_win = n_win
+        # Ключ состояния в getState: Zobrist хэш (int, по умолчанию) или строка getHash (как раньше).
+        # Таблицы со строковыми ключами (например, сохраненные Q) переводятся convert_state_keys
+        self.int_hash = int_hash
 
         self.board = np.zeros((self.n_rows, self.n_cols), dtype=int)
+        # Битовые доски крестиков и ноликов (бит i * n_cols + j -- клетка (i, j)): победа проверяется
+        # по маскам win_masks линий через сыгранную клетку, (bitboard & mask) == mask
+        self.bitboards = {1: 0, -1: 0}
+        self.win_masks = win_masks(n_rows, n_cols, n_win)
+        # Счетчики меток каждого игрока на каждой линии (для угроз в решателе), победитель и число
+        # пустых клеток обновляются при каждом ходе только по линиям через сыгранную клетку
+        self.cell_lines = cell_lines(n_rows, n_cols, n_win)
+        self.line_counts = {1: [0] * len(self.win_masks), -1: [0] * len(self.win_masks)}
+        self.winner = None
+        self.n_empty = n_rows * n_cols
+        # Zobrist хэш доски, обновляется через XOR в makeMove
+        self.zobristKeys, _ = zobrist_keys(n_rows, n_cols)
+        self.zobristHash = 0
+        # Zobrist хэши доски после каждой симметрии (для канонического состояния). Обновлять их при
+        # каждом ходе -- лишние XOR, поэтому только с track_symmetries=True (например, в решателе),
+        # иначе getCanonicalState считает их по доске
+        self.symmetries = symmetries(n_rows, n_cols)
+        self.inverseSymmetries = inverse_symmetries(n_rows, n_cols)
+        self.symmetryKeys = symmetry_keys(n_rows, n_cols)
+        self.track_symmetries = track_symmetries
+        self.symmetryHashes = None
         self.gameOver = False
         self.boardHash = None
         # ход первого игрока
@@ -27,6 +193,9 @@ class TicTacToe(gym.Env):
         self.prev_naughts_state = None
         self.prev_naughts_action = None
         
+        # Стек ходов для отмены через pop
+        self.history = []
+        
         self.reset()
         self.seed()
         
@@ -39,8 +208,7 @@ class TicTacToe(gym.Env):
 
     def getEmptySpaces(self):
         if self.emptySpaces is None:
-            res = np.where(self.board == 0)
-            self.emptySpaces = np.array([ (i, j) for i,j in zip(res[0], res[1]) ])
+            self.emptySpaces = np.argwhere(self.board == 0)
         return self.emptySpaces
     
     def getEmptyInts(self):
@@ -48,41 +216,51 @@ class TicTacToe(gym.Env):
         return np.array([self.int_from_action(a) for a in spaces], dtype=int)
 
     def makeMove(self, player, i, j):
+        cell = i * self.n_cols + j
         self.board[i, j] = player
+        bitboard = self.bitboards[player] | (1 << cell)
+        self.bitboards[player] = bitboard
+        key = cell if player > 0 else self.n_rows * self.n_cols + cell
+        self.zobristHash ^= self.zobristKeys[key]
+        if self.track_symmetries:
+            for k, keys in enumerate(self.symmetryKeys):
+                self.symmetryHashes[k] ^= keys[key]
+        self.n_empty -= 1
+        counts, masks = self.line_counts[player], self.win_masks
+        for k in self.cell_lines[cell]:
+            counts[k] += 1
+            if bitboard & masks[k] == masks[k]:
+                self.winner = player
         self.emptySpaces = None
         self.boardHash = None
 
+    def unmakeMove(self, player, i, j):
+        # Обратная к makeMove операция (кэши восстанавливает pop)
+        cell = i * self.n_cols + j
+        self.board[i, j] = 0
+        self.bitboards[player] &= ~(1 << cell)
+        key = cell if player > 0 else self.n_rows * self.n_cols + cell
+        self.zobristHash ^= self.zobristKeys[key]
+        if self.track_symmetries:
+            for k, keys in enumerate(self.symmetryKeys):
+                self.symmetryHashes[k] ^= keys[key]
+        self.n_empty += 1
+        counts = self.line_counts[player]
+        for k in self.cell_lines[cell]:
+            counts[k] -= 1
+
     def getHash(self):
         if self.boardHash is None:
             self.boardHash = ''.join(['%s' % (x+1) for x in self.board.reshape(self.n_rows * self.n_cols)])
         return self.boardHash
 
     def isTerminal(self):
-        # проверим, не закончилась ли игра
-        cur_marks, cur_p = np.where(self.board == self.curTurn), self.curTurn
-        for i,j in zip(cur_marks[0], cur_marks[1]):
-#             print((i,j))
-            win = False
-            if i <= self.n_rows - self.n_win:
-                if np.all(self.board[i:i+self.n_win, j] == cur_p):
-                    win = True
-            if not win:
-                if j <= self.n_cols - self.n_win:
-                    if np.all(self.board[i,j:j+self.n_win] == cur_p):
-                        win = True
-            if not win:
-                if i <= self.n_rows - self.n_win and j <= self.n_cols - self.n_win:
-                    if np.all(np.array([ self.board[i+k,j+k] == cur_p for k in range(self.n_win) ])):
-                        win = True
-            if not win:
-                if i <= self.n_rows - self.n_win and j >= self.n_win-1:
-                    if np.all(np.array([ self.board[i+k,j-k] == cur_p for k in range(self.n_win) ])):
-                        win = True
-            if win:
-                self.gameOver = True
-                return self.curTurn
-
-        if len(self.getEmptySpaces()) == 0:
+        # проверим, не закончилась ли игра (победитель и пустые клетки считаются в makeMove)
+        if self.winner == self.curTurn:
+            self.gameOver = True
+            return self.curTurn
+
+        if self.n_empty == 0:
             self.gameOver = True
             return 0
 
@@ -106,8 +284,46 @@ class TicTacToe(gym.Env):
 
     def getState(self):
         #return (self.getHash(), self.getEmptySpaces(), self.curTurn)
+        if self.int_hash:
+            return (self.zobristHash, self.curTurn)
         return (self.getHash(), self.curTurn)
 
+    def computeSymmetryHashes(self):
+        # Zobrist хэши доски после каждой симметрии, посчитанные по доске
+        n_cells = self.n_rows * self.n_cols
+        cells = self.board.ravel()
+        keys = np.flatnonzero(cells > 0).tolist() + (n_cells + np.flatnonzero(cells < 0)).tolist()
+        hashes = []
+        for symmetry_keys in self.symmetryKeys:
+            value = 0
+            for key in keys:
+                value ^= symmetry_keys[key]
+            hashes.append(value)
+        return hashes
+
+    def startTrackingSymmetries(self):
+        # Включаем обновление хэшей симметрий при ходах (с текущей доски)
+        self.track_symmetries = True
+        self.symmetryHashes = self.computeSymmetryHashes()
+
+    def getCanonicalState(self):
+        # Каноническое состояние (минимальный хэш среди симметричных досок) и номер симметрии,
+        # которая переводит доску в каноническую
+        hashes = self.symmetryHashes if self.track_symmetries else self.computeSymmetryHashes()
+        canonical = min(hashes)
+        transform = hashes.index(canonical)
+        if not self.int_hash:
+            canonical = string_from_hash(canonical, self.n_rows, self.n_cols)
+        return (canonical, self.curTurn), transform
+
+    def canonical_action(self, action_int, transform):
+        # Действие в системе координат канонической доски
+        return self.symmetries[transform][action_int]
+
+    def action_from_canonical(self, action_int, transform):
+        # Действие на доске по действию на канонической доске
+        return self.inverseSymmetries[transform][action_int]
+
     def action_from_int(self, action_int):
         return ( int(action_int / self.n_cols), int(action_int % self.n_cols))
 
@@ -145,8 +361,50 @@ class TicTacToe(gym.Env):
         self.curTurn = -self.curTurn
         return self.getState(), 0 if reward is None else reward, reward is not None, {}
 
+    def push(self, action):
+        # Ход, который можно отменить через pop (сохраняем все, что меняет step)
+        self.history.append((
+            action, self.board[action[0], action[1]] == 0, self.curTurn,
+            self.emptySpaces, self.boardHash, self.winner, self.gameOver,
+            self.prev_crosses_state, self.prev_crosses_action,
+            self.prev_naughts_state, self.prev_naughts_action
+        ))
+        return self.step(action)
+    
+    def push_int(self, intAction):
+        return self.push(self.action_from_int(intAction))
+    
+    def pop(self):
+        # Отменяем последний ход из push
+        (
+            (i, j), moved, self.curTurn,
+            self.emptySpaces, self.boardHash, self.winner, self.gameOver,
+            self.prev_crosses_state, self.prev_crosses_action,
+            self.prev_naughts_state, self.prev_naughts_action
+        ) = self.history.pop()
+        if moved:
+            self.unmakeMove(self.curTurn, i, j)
+    
+    def clone(self):
+        # Быстрая копия среды для симуляций: копируются доска и счетчики,
+        # кэшированные маски и генератор np_random общие с исходной средой
+        env = copy(self)
+        env.board = self.board.copy()
+        env.bitboards = dict(self.bitboards)
+        env.line_counts = {1: list(self.line_counts[1]), -1: list(self.line_counts[-1])}
+        if self.track_symmetries:
+            env.symmetryHashes = list(self.symmetryHashes)
+        env.history = []
+        return env
+
     def reset(self):
         self.board = np.zeros((self.n_rows, self.n_cols), dtype=int)
+        self.bitboards = {1: 0, -1: 0}
+        self.line_counts = {1: [0] * len(self.win_masks), -1: [0] * len(self.win_masks)}
+        self.winner = None
+        self.n_empty = self.n_rows * self.n_cols
+        self.zobristHash = 0
+        self.symmetryHashes = [0] * len(self.symmetries) if self.track_symmetries else None
         self.boardHash = None
         self.gameOver = False
         self.emptySpaces = None
@@ -156,10 +414,81 @@ class TicTacToe(gym.Env):
         self.prev_crosses_action = None
         self.prev_naughts_state = None
         self.prev_naughts_action = None
+        self.history = []
         
         return self.getState()
         
         
+
+class TicTacToeVectorEnv(gym.Env):
+    '''num_envs независимых партий, которые делают ход одновременно
+    Доски хранятся одним массивом boards размера (num_envs, n_rows, n_cols) типа int8,
+    step принимает вектор действий (номера клеток), конец партий проверяется для всех досок
+    сразу умножением на матрицу линий. Награды как в TicTacToe: 1 (победа крестиков),
+    -1 (победа ноликов), 0 (ничья или партия продолжается), -10 (ход в занятую клетку).
+    Закончившиеся партии сразу начинаются заново, их последние доски возвращаются в
+    info['terminal_boards']'''
+    def __init__(self, num_envs=256, n_rows=N_ROWS, n_cols=N_COLS, n_win=N_WIN):
+        self.num_envs = num_envs
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.n_win = n_win
+        self.lines = line_matrix(n_rows, n_cols, n_win).T
+        
+        self.boards = np.zeros((num_envs, n_rows, n_cols), dtype=np.int8)
+        # ход первого игрока на всех досках
+        self.curTurn = np.ones(num_envs, dtype=np.int8)
+        
+        self.reset()
+        self.seed()
+        
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+        
+    def getTotalNumberOfActions(self):
+        return self.n_rows * self.n_cols
+    
+    def getEmptyMask(self):
+        # Маска свободных клеток размера (num_envs, n_rows * n_cols)
+        return self.boards.reshape(self.num_envs, -1) == 0
+    
+    def randomIntActions(self):
+        # Случайная свободная клетка на каждой доске
+        scores = self.np_random.uniform(size=(self.num_envs, self.n_rows * self.n_cols))
+        scores[~self.getEmptyMask()] = -1.0
+        return np.argmax(scores, axis=1)
+    
+    def step(self, actions):
+        actions = np.asarray(actions)
+        index = np.arange(self.num_envs)
+        cells = self.boards.reshape(self.num_envs, -1)
+        
+        # Ставим метки текущих игроков (кроме ходов в занятые клетки)
+        invalid = cells[index, actions] != 0
+        cells[index[~invalid], actions[~invalid]] = self.curTurn[~invalid]
+        
+        # Сумма меток на каждой линии равна n_win * curTurn, если текущий игрок собрал линию
+        sums = cells.astype(np.float32) @ self.lines
+        win = ~invalid & np.any(sums == self.n_win * self.curTurn[:, None], axis=1)
+        draw = ~invalid & ~win & np.all(cells != 0, axis=1)
+        
+        rewards = np.where(invalid, -10, np.where(win, self.curTurn, 0))
+        dones = invalid | win | draw
+        info = {'terminal_boards': self.boards[dones].copy()}
+        
+        self.curTurn = -self.curTurn
+        self.reset(dones)
+        return self.boards.copy(), rewards, dones, info
+    
+    def reset(self, mask=None):
+        # Начинаем заново все партии или только отмеченные (например, mask=dones)
+        mask = np.ones(self.num_envs, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        self.boards[mask] = 0
+        self.curTurn[mask] = 1
+        return self.boards.copy()
+        
+        
 def plot_board(env, pi, showtext=True, verbose=True, fontq=20, fontx=60):
     '''Рисуем доску с оценками из стратегии pi'''
     fig, ax = plt.subplots(1, 1, figsize=(8, 8))
@@ -0,0 +1,181 @@
+import os
+import queue
+from copy import deepcopy
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from tic_tac_toe import TicTacToeVectorEnv
+from tic_tac_toe_nn import policy_nn_batch
+
+
+def acting_models(dqn):
+    '''Модели крестиков и ноликов, по которым играют DQN классы ноутбука (для Double -- первые из пар)'''
+    if hasattr(dqn, 'model_crosses'):
+        return dqn.model_crosses, dqn.model_naughts
+    return dqn.models_crosses[0], dqn.models_naughts[0]
+
+
+def _publish(models, snapshots, version, shared_eps, eps):
+    # Копируем веса обучаемых сетей в разделяемые снимки под блокировкой и увеличиваем версию
+    # (вместе с весами публикуется текущий eps из расписания)
+    with version.get_lock():
+        for model, snapshot in zip(models, snapshots):
+            snapshot.load_state_dict(model.state_dict())
+        shared_eps.value = eps
+        version.value += 1
+
+
+def _actor(snapshots, version, shared_eps, n_rows, n_cols, n_win, transitions, stop, num_envs, sync_every, steps_per_item, seed):
+    '''Процесс-актор: играет num_envs партий сам с собой на TicTacToeVectorEnv локальными копиями
+    сетей и отправляет переходы каждой стороны в очередь в том же виде, что и run_episode:
+    (доска перед своим ходом, ход, награда стороны, доска перед следующим своим ходом или
+    конечная доска, конец партии). Переходы steps_per_item ходов отправляются одним элементом
+    очереди из numpy массивов (они передаются через pipe, без разделяемой памяти на каждый тензор)'''
+    torch.manual_seed(seed)
+    local = {1: deepcopy(snapshots[0]).eval(), -1: deepcopy(snapshots[1]).eval()}
+    shared = {1: snapshots[0], -1: snapshots[1]}
+    local_version = -1
+
+    env = TicTacToeVectorEnv(num_envs, n_rows, n_cols, n_win)
+    env.seed(seed)
+    # Незаконченный переход каждой стороны: доска перед ходом и ход (ждем ответа противника)
+    prev_boards = {side: np.zeros_like(env.boards) for side in (1, -1)}
+    prev_actions = {side: np.zeros(num_envs, dtype=np.int64) for side in (1, -1)}
+    pending = {side: np.zeros(num_envs, dtype=bool) for side in (1, -1)}
+
+    step, n_games = 0, 0
+    batches = {1: [], -1: []}
+    while not stop.is_set():
+        # Синхронизируем веса и eps с последним снимком, если learner опубликовал новый (под той же
+        # блокировкой, что и публикация, так что снимок не читается наполовину обновленным)
+        if step % sync_every == 0 and version.value != local_version:
+            with version.get_lock():
+                for side in (1, -1):
+                    local[side].load_state_dict(shared[side].state_dict())
+                local_version, eps = version.value, shared_eps.value
+            policies = {side: policy_nn_batch(model, eps) for side, model in local.items()}
+        step += 1
+
+        boards, turns, masks = env.boards.copy(), env.curTurn.copy(), env.getEmptyMask()
+        actions = np.zeros(num_envs, dtype=np.int64)
+        for side in (1, -1):
+            if np.any(turns == side):
+                actions[turns == side] = policies[side](boards[turns == side], masks[turns == side])
+
+        _, rewards, dones, info = env.step(actions)
+        after = env.boards.copy()
+        after[dones] = info['terminal_boards']
+        n_games += int(dones.sum())
+
+        for side in (1, -1):
+            mover = turns == side
+            # Противник ответил -- заканчиваем прошлый переход стороны доской перед ее ходом
+            sel = mover & pending[side]
+            batches[side].append((prev_boards[side][sel], prev_actions[side][sel], np.zeros(sel.sum(), dtype=np.float32), boards[sel], np.zeros(sel.sum(), dtype=bool)))
+            # Партия закончилась ходом стороны: конечные переходы обеих сторон
+            sel = mover & dones
+            batches[side].append((boards[sel], actions[sel], (rewards[sel] * side).astype(np.float32), after[sel], np.ones(sel.sum(), dtype=bool)))
+            sel = mover & dones & pending[-side]
+            batches[-side].append((prev_boards[-side][sel], prev_actions[-side][sel], (rewards[sel] * -side).astype(np.float32), after[sel], np.ones(sel.sum(), dtype=bool)))
+            # Партия продолжается -- ход стороны ждет ответа
+            sel = mover & ~dones
+            prev_boards[side][sel], prev_actions[side][sel] = boards[sel], actions[sel]
+            pending[side][mover] = ~dones[mover]
+        for side in (1, -1):
+            pending[side][dones] = False
+
+        if step % steps_per_item != 0:
+            continue
+        # Элемент очереди: число законченных партий и переходы каждой стороны
+        item = (n_games, {side: tuple(np.concatenate(x) for x in zip(*batch)) for side, batch in batches.items()})
+        n_games, batches = 0, {1: [], -1: []}
+        while not stop.is_set():
+            try:
+                transitions.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+
+def train_actor_learner(dqn, n_updates, n_actors=None, num_envs=64, eps=None, sync_every=50, publish_every=10, steps_per_item=8,
+                        queue_size=64, timeout=30.0, seed=0):
+    '''Обучение DQN классов ноутбука (TicTacToeDQN, TicTacToeDoubleDQN, ...) в режиме actor-learner
+    (вызывается из их метода train_actor_learner). n_actors процессов играют партии сами с собой
+    со своими копиями сетей и отправляют переходы в очередь, текущий процесс (learner)
+    перекладывает их в память dqn и делает n_updates шагов dqn.learn(). Каждые publish_every
+    шагов learner публикует веса в разделяемые снимки с номером версии, акторы каждые sync_every
+    ходов забирают новую версию.
+    eps=None -- eps берется из dqn.eps_generator, как в run_episode: генератор сдвигается на каждую
+    законченную акторами партию, и последнее значение публикуется вместе с весами; число -- eps
+    акторов постоянный. Если за timeout секунд не пришло переходов и все акторы завершились,
+    выбрасывается RuntimeError'''
+    n_actors = n_actors or max(os.cpu_count() - 1, 1)
+    # fork, а не spawn: сети ноутбука определены в __main__ и не импортируются в spawn процессе.
+    # Число потоков torch ставим до fork, чтобы акторы не работали с пулом потоков родителя
+    ctx = mp.get_context('fork')
+    models = acting_models(dqn)
+    snapshots = [deepcopy(model).share_memory() for model in models]
+    version = ctx.Value('q', 0)
+    current_eps = next(dqn.eps_generator) if eps is None else eps
+    shared_eps = ctx.Value('d', current_eps, lock=False)
+
+    transitions, stop = ctx.Queue(queue_size), ctx.Event()
+    actors = [
+        ctx.Process(target=_actor, args=(snapshots, version, shared_eps, dqn.n_rows, dqn.n_cols, dqn.n_win, transitions, stop,
+                                         num_envs, sync_every, steps_per_item, seed + i), daemon=True)
+        for i in range(n_actors)
+    ]
+    n_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        for actor in actors:
+            actor.start()
+    finally:
+        torch.set_num_threads(n_threads)
+
+    memories = {1: dqn.memory_crosses, -1: dqn.memory_naughts}
+    def receive(block=True):
+        # Следующий элемент очереди (None, если block=False и очередь пуста)
+        while True:
+            try:
+                return transitions.get(timeout=timeout) if block else transitions.get_nowait()
+            except queue.Empty:
+                if not block:
+                    return None
+                if not any(actor.is_alive() for actor in actors):
+                    raise RuntimeError(f'Все акторы завершились, exitcode: {[actor.exitcode for actor in actors]}')
+
+    def store(item):
+        nonlocal current_eps
+        n_games, batches = item
+        for side, batch in batches.items():
+            if len(batch[1]):
+                memories[side].store_batch(*batch)
+        if eps is None:
+            for _ in range(n_games):
+                current_eps = next(dqn.eps_generator)
+
+    try:
+        for update in range(n_updates):
+            # Ждем, пока в памяти не наберется батч, потом забираем все, что уже пришло
+            while min(len(memory) for memory in memories.values()) < dqn.batch_size:
+                store(receive())
+            for _ in range(queue_size):
+                item = receive(block=False)
+                if item is None:
+                    break
+                store(item)
+            dqn.learn()
+            if (update + 1) % publish_every == 0:
+                _publish(models, snapshots, version, shared_eps, current_eps)
+    finally:
+        stop.set()
+        for actor in actors:
+            actor.join(timeout=5)
+            if actor.is_alive():
+                actor.terminate()
+    for model in models:
+        model.eval()
+    return dqn
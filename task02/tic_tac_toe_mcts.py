@@ -0,0 +1,553 @@
+import multiprocessing as mp
+import os
+import random
+import threading
+import time
+import weakref
+
+import numpy as np
+from gym.utils import seeding
+
+
+def policy_random_int(env):
+    '''Случайный ход среды (стратегия по умолчанию для rollout'ов)'''
+    return env.randomIntAction()
+
+
+class ArenaMCTS:
+    '''MCTS, в котором дерево хранится в заранее выделенных массивах вместо объектов StateNode/ActionNode
+    Узел -- состояние (позиция), у него подряд лежащие ребра -- возможные ходы: node_first[node] --
+    номер первого ребра, node_size[node] -- число ребер. Для ребер хранятся ход, номер узла потомка
+    (-1, пока ход не делали), число посещений, сумма наград (с точки зрения игрока, который делает
+    ход) и априорная вероятность хода. Число посещений узла обновляется при backup, а не суммируется
+    по потомкам, поэтому UCT считается одной векторной операцией по ребрам узла.
+    Одинаковые позиции, до которых дошли разными путями, -- один узел (словарь index по getState).
+    Массивы увеличиваются вдвое при заполнении.
+    max_nodes -- ограничение числа узлов: при заполнении остаются только узлы, достижимые из корня
+    поиска, и из них 3/4 max_nodes последних использованных (LRU), массивы уплотняются.
+    reroot_each_move -- в начале каждого поиска оставлять только поддерево текущей позиции
+    (статистика продолжения партии сохраняется, остальное дерево освобождается)'''
+    def __init__(self, c=1.0, capacity=1024, policy_crosses=None, policy_naughts=None, max_nodes=None, reroot_each_move=False):
+        self.c = c
+        # Стратегии rollout'ов: env -> номер клетки
+        self.policies = {1: policy_crosses or policy_random_int, -1: policy_naughts or policy_random_int}
+        self.capacity = capacity
+        self.max_nodes = max_nodes
+        self.reroot_each_move = reroot_each_move
+        self.reset()
+
+    def reset(self):
+        # Узлы
+        self.node_first = np.zeros(self.capacity, dtype=np.int64)
+        self.node_size = np.zeros(self.capacity, dtype=np.int64)
+        self.node_visits = np.zeros(self.capacity)
+        self.node_turn = np.zeros(self.capacity, dtype=np.int8)
+        # Результат партии для конечных позиций (1, -1, 0 -- с точки зрения крестиков), иначе nan
+        self.node_outcome = np.full(self.capacity, np.nan)
+        # Номер симуляции, в которой узел последний раз был на пути (для LRU)
+        self.node_stamp = np.zeros(self.capacity, dtype=np.int64)
+        # Ребра (на каждый узел не больше n_rows * n_cols)
+        self.edge_action = np.zeros(self.capacity, dtype=np.int64)
+        self.edge_child = np.full(self.capacity, -1, dtype=np.int64)
+        self.edge_visits = np.zeros(self.capacity)
+        self.edge_value = np.zeros(self.capacity)
+        self.edge_prior = np.zeros(self.capacity, dtype=np.float32)
+        self.n_nodes = 0
+        self.n_edges = 0
+        self.index = {}
+        self.clock = 0
+
+    def _grow(self, prefix, size):
+        # Увеличиваем все массивы узлов (prefix='node_') или ребер (prefix='edge_') до size и больше
+        for name, array in list(vars(self).items()):
+            if name.startswith(prefix) and len(array) < size:
+                grown = np.resize(array, max(size, 2 * len(array)))
+                grown[len(array):] = -1 if name == 'edge_child' else (np.nan if name == 'node_outcome' else 0)
+                setattr(self, name, grown)
+
+    def add_node(self, env, outcome=None):
+        # Узел текущей позиции env (создается, если его еще нет), возвращает номер узла и флаг создания
+        key = env.getState()
+        node = self.index.get(key)
+        if node is not None:
+            return node, False
+
+        node = self.n_nodes
+        actions = np.array([], dtype=np.int64) if outcome is not None else env.getEmptyInts()
+        # Порядок ребер случайный: непосещенные ходы выбираются по порядку
+        actions = env.np_random.permutation(actions)
+        self._grow('node_', node + 1)
+        self._grow('edge_', self.n_edges + len(actions))
+
+        edges = slice(self.n_edges, self.n_edges + len(actions))
+        self.node_first[node], self.node_size[node] = self.n_edges, len(actions)
+        self.node_visits[node] = 0
+        self.node_turn[node] = env.curTurn
+        self.node_outcome[node] = np.nan if outcome is None else outcome
+        self.node_stamp[node] = self.clock
+        self.edge_action[edges] = actions
+        self.edge_child[edges] = -1
+        self.edge_visits[edges] = 0
+        self.edge_value[edges] = 0
+        self.edge_prior[edges] = 1.0 / max(len(actions), 1)
+
+        self.n_nodes += 1
+        self.n_edges += len(actions)
+        self.index[key] = node
+        return node, True
+
+    def edges(self, node):
+        return slice(self.node_first[node], self.node_first[node] + self.node_size[node])
+
+    def node_edges(self, nodes):
+        # Номера всех ребер узлов nodes подряд
+        sizes = self.node_size[nodes]
+        starts = self.node_first[nodes] - np.cumsum(sizes) + sizes
+        return np.repeat(starts, sizes) + np.arange(sizes.sum())
+
+    def reachable(self, root, allowed=None):
+        # Маска узлов, достижимых из root (только через узлы из маски allowed)
+        alive = np.zeros(self.n_nodes, dtype=bool)
+        alive[root] = True
+        frontier = np.array([root])
+        while len(frontier):
+            children = self.edge_child[self.node_edges(frontier)]
+            children = np.unique(children[children >= 0])
+            children = children[~alive[children] & (True if allowed is None else allowed[children])]
+            alive[children] = True
+            frontier = children
+        return alive
+
+    def compact(self, alive):
+        # Оставляем узлы из маски alive (с их ребрами), ссылки на удаленные узлы становятся -1
+        nodes = np.flatnonzero(alive)
+        remap = np.full(self.n_nodes, -1, dtype=np.int64)
+        remap[nodes] = np.arange(len(nodes))
+        edges = self.node_edges(nodes)
+
+        sizes = self.node_size[nodes]
+        for name, array in list(vars(self).items()):
+            if name.startswith('node_'):
+                array[:len(nodes)] = array[nodes]
+            elif name.startswith('edge_'):
+                array[:len(edges)] = array[edges]
+        self.node_first[:len(nodes)] = np.cumsum(sizes) - sizes
+        children = self.edge_child[:len(edges)]
+        children[children >= 0] = remap[children[children >= 0]]
+
+        self.index = {key: remap[node] for key, node in self.index.items() if remap[node] >= 0}
+        self.n_nodes, self.n_edges = len(nodes), len(edges)
+
+    def reroot(self, env):
+        # Оставляем только поддерево позиции env
+        root = self.index.get(env.getState())
+        if root is None:
+            self.reset()
+        else:
+            self.compact(self.reachable(root))
+
+    def collect(self, env, n_new=1):
+        # Освобождаем место, если после добавления n_new узлов будет больше max_nodes
+        if self.max_nodes is None or self.n_nodes + n_new <= self.max_nodes:
+            return
+        root, _ = self.add_node(env)
+        alive = self.reachable(root)
+        keep = max(3 * self.max_nodes // 4 - n_new, 1)
+        if alive.sum() > keep:
+            # Последние использованные узлы (корень обновлен в add_node/backup последним), потомки
+            # не свежее предков на пути, поэтому после отбора почти все остаются достижимыми
+            stamps = np.where(alive, self.node_stamp[:self.n_nodes], -1)
+            stamps[root] = self.clock + 1
+            allowed = np.zeros(self.n_nodes, dtype=bool)
+            allowed[np.argsort(-stamps, kind='stable')[:keep]] = True
+            alive = self.reachable(root, allowed)
+        self.compact(alive)
+
+    def uct(self, node):
+        # UCT всех ходов узла сразу, непосещенные ходы -- inf
+        edges = self.edges(node)
+        visits = self.edge_visits[edges]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = self.edge_value[edges] / visits + self.c * np.sqrt(np.log(self.node_visits[node]) / visits)
+        scores[visits == 0] = np.inf
+        return scores
+
+    def score(self, node):
+        # Оценки ходов при спуске по дереву (переопределяется в наследниках)
+        return self.uct(node)
+
+    def select(self, env):
+        # Спуск от текущей позиции env по максимуму score до нового или конечного узла.
+        # Ходы делаются в env через push (их отменяет search), возвращает узлы и ребра пути
+        node, _ = self.add_node(env)
+        nodes, edges = [], []
+        while np.isnan(self.node_outcome[node]):
+            edge = self.node_first[node] + np.argmax(self.score(node))
+            nodes.append(node)
+            edges.append(edge)
+            _, reward, done, _ = env.push_int(self.edge_action[edge])
+
+            child, created = self.edge_child[edge], False
+            if child < 0:
+                child, created = self.add_node(env, reward if done else None)
+                self.edge_child[edge] = child
+            node = child
+            if created:
+                break
+        return nodes, edges, node
+
+    def rollout(self, env):
+        # Доигрываем партию стратегиями rollout'ов и возвращаем среду в исходную позицию
+        n_moves, done = 0, False
+        while not done:
+            _, reward, done, _ = env.push_int(self.policies[env.curTurn](env))
+            n_moves += 1
+        for _ in range(n_moves):
+            env.pop()
+        return reward
+
+    def evaluate(self, env, node):
+        # Результат партии из листа с точки зрения крестиков
+        if not np.isnan(self.node_outcome[node]):
+            return self.node_outcome[node]
+        return self.rollout(env)
+
+    def backup(self, nodes, edges, value):
+        # Позиции на пути не повторяются (число меток на доске растет), поэтому обновляем сразу весь путь
+        nodes, edges = np.array(nodes, dtype=np.int64), np.array(edges, dtype=np.int64)
+        self.node_visits[nodes] += 1
+        self.edge_visits[edges] += 1
+        self.edge_value[edges] += value * self.node_turn[nodes]
+        self.clock += 1
+        self.node_stamp[nodes] = self.clock
+
+    def add_virtual_loss(self, nodes, edges, loss):
+        # Виртуальный проигрыш на пути (loss посещений с наградой -1 для ходящего), снимается с loss < 0
+        nodes, edges = np.array(nodes, dtype=np.int64), np.array(edges, dtype=np.int64)
+        self.node_visits[nodes] += loss
+        self.edge_visits[edges] += loss
+        self.edge_value[edges] -= loss
+
+    def search(self, env, n_simulations=100):
+        # n_simulations итераций selection / expansion / simulation / backup из позиции env
+        env = env.clone()
+        if self.reroot_each_move:
+            self.reroot(env)
+        for _ in range(n_simulations):
+            # Симуляция добавляет не больше одного узла
+            self.collect(env)
+            nodes, edges, leaf = self.select(env)
+            self.backup(nodes, edges, self.evaluate(env, leaf))
+            for _ in edges:
+                env.pop()
+        return self.index[env.getState()]
+
+    def visit_counts(self, env):
+        # Число посещений каждой клетки доски из позиции env (0 для занятых и непосещенных)
+        counts = np.zeros(env.getTotalNumberOfActions())
+        node = self.index.get(env.getState())
+        if node is not None:
+            edges = self.edges(node)
+            counts[self.edge_action[edges]] = self.edge_visits[edges]
+        return counts
+
+    def __call__(self, env, n_simulations=100):
+        # Ход после поиска -- самый посещаемый
+        root = self.search(env, n_simulations)
+        edges = self.edges(root)
+        return int(self.edge_action[edges][np.argmax(self.edge_visits[edges])])
+
+
+def policy_mcts_arena(policy_crosses=None, policy_naughts=None, n_simulations=100, c=1.0, capacity=1024, max_nodes=None, reroot_each_move=False):
+    '''Стратегия по ArenaMCTS (аналог policy_mcts), дерево общее для всех ходов и партий стратегии'''
+    mcts = ArenaMCTS(c=c, capacity=capacity, policy_crosses=policy_crosses, policy_naughts=policy_naughts,
+                     max_nodes=max_nodes, reroot_each_move=reroot_each_move)
+    def strategy(env):
+        return mcts(env, n_simulations=n_simulations)
+    return strategy
+
+
+def _mcts_worker(mcts, conn, seed):
+    # Процесс ParallelMCTS: поиск по своему дереву ('search') или rollout'ы из присланных позиций ('rollout')
+    random.seed(seed)
+    np_random, _ = seeding.np_random(seed)
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        command, envs, n_simulations = task
+        # Среды приходят с копией генератора мастера -- заменяем на свой, иначе rollout'ы совпадут
+        for env in envs:
+            env.np_random = np_random
+        if command == 'search':
+            mcts.search(envs[0], n_simulations)
+            conn.send(mcts.visit_counts(envs[0]))
+        else:
+            conn.send([mcts.rollout(env) for env in envs])
+
+
+def _stop_workers(workers):
+    # Останавливаем процессы ParallelMCTS (список очищается, повторный вызов ничего не делает)
+    for process, conn in workers:
+        try:
+            conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+        conn.close()
+    workers.clear()
+
+
+class ParallelMCTS(ArenaMCTS):
+    '''ArenaMCTS, в котором симуляции одного хода делят n_workers процессов
+    mode='root' -- распараллеливание по корню: у каждого процесса свое дерево (сохраняется между
+    ходами), каждый делает свою долю n_simulations, ход выбирается по сумме посещений ходов корня.
+    mode='leaf' -- общее дерево в текущем процессе: за раунд выбирается n_workers * leaves_per_worker
+    листьев, на пути к каждому добавляется виртуальный проигрыш (virtual_loss посещений с наградой -1
+    для ходящего), чтобы следующие спуски раунда шли в другие листья, rollout'ы из листьев делают
+    процессы, после чего виртуальный проигрыш снимается и делается обычный backup.
+    Процессы запускаются через fork при первом поиске (стратегии rollout'ов не копируются через
+    pickle, поэтому подходят замыкания ноутбука) и останавливаются в close, при выходе из with или,
+    если close не вызвали, когда объект удаляется сборщиком мусора или завершается интерпретатор
+    (weakref.finalize)'''
+    def __init__(self, n_workers=None, mode='root', virtual_loss=1.0, leaves_per_worker=4, c=1.0, capacity=1024,
+                 policy_crosses=None, policy_naughts=None, max_nodes=None, reroot_each_move=False, seed=0):
+        super().__init__(c=c, capacity=capacity, policy_crosses=policy_crosses, policy_naughts=policy_naughts,
+                         max_nodes=max_nodes, reroot_each_move=reroot_each_move)
+        assert mode in ('root', 'leaf')
+        self.n_workers = n_workers or os.cpu_count()
+        self.mode = mode
+        self.virtual_loss = virtual_loss
+        self.leaves_per_worker = leaves_per_worker
+        self.seed = seed
+        self.workers = []
+        # Финализатор ссылается только на список процессов, а не на self, и не мешает сборке мусора
+        self._finalizer = weakref.finalize(self, _stop_workers, self.workers)
+
+    def start(self):
+        ctx = mp.get_context('fork')
+        for i in range(self.n_workers):
+            conn, worker_conn = ctx.Pipe()
+            tree = ArenaMCTS(c=self.c, capacity=self.capacity, policy_crosses=self.policies[1], policy_naughts=self.policies[-1],
+                             max_nodes=self.max_nodes, reroot_each_move=self.reroot_each_move)
+            process = ctx.Process(target=_mcts_worker, args=(tree, worker_conn, self.seed + i), daemon=True)
+            process.start()
+            self.workers.append((process, conn))
+
+    def close(self):
+        _stop_workers(self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run(self, command, tasks):
+        # Раздаем задачи процессам (по одной на процесс) и собираем ответы
+        if not self.workers:
+            self.start()
+        for (_, conn), (envs, n_simulations) in zip(self.workers, tasks):
+            conn.send((command, envs, n_simulations))
+        return [conn.recv() for (_, conn), _ in zip(self.workers, tasks)]
+
+    def search(self, env, n_simulations=100):
+        # Общее дерево: раунды из нескольких спусков с виртуальным проигрышем и параллельных rollout'ов
+        env = env.clone()
+        if self.reroot_each_move:
+            self.reroot(env)
+        n_done = 0
+        while n_done < n_simulations:
+            paths, leaves = [], []
+            n_leaves = min(self.n_workers * self.leaves_per_worker, n_simulations - n_done)
+            # Узлы удаляются только между раундами (пути раунда ссылаются на номера узлов)
+            self.collect(env, n_leaves)
+            for _ in range(n_leaves):
+                nodes, edges, leaf = self.select(env)
+                self.add_virtual_loss(nodes, edges, self.virtual_loss)
+                paths.append((nodes, edges, leaf))
+                # Из конечных позиций rollout не нужен
+                if np.isnan(self.node_outcome[leaf]):
+                    leaves.append((len(paths) - 1, env.clone()))
+                for _ in edges:
+                    env.pop()
+
+            values = [self.node_outcome[leaf] for _, _, leaf in paths]
+            chunks = [leaves[i::self.n_workers] for i in range(self.n_workers)]
+            results = self.run('rollout', [([leaf_env for _, leaf_env in chunk], 0) for chunk in chunks])
+            for chunk, rewards in zip(chunks, results):
+                for (i, _), reward in zip(chunk, rewards):
+                    values[i] = reward
+
+            for (nodes, edges, _), value in zip(paths, values):
+                self.add_virtual_loss(nodes, edges, -self.virtual_loss)
+                self.backup(nodes, edges, value)
+            n_done += len(paths)
+        return self.index[env.getState()]
+
+    def root_visit_counts(self, env, n_simulations=100):
+        # Сумма посещений ходов корня по деревьям всех процессов
+        n_per_worker = -(-n_simulations // self.n_workers)
+        counts = self.run('search', [([env.clone()], n_per_worker)] * self.n_workers)
+        return np.sum(counts, axis=0)
+
+    def __call__(self, env, n_simulations=100):
+        if self.mode == 'leaf':
+            return super().__call__(env, n_simulations)
+        counts = self.root_visit_counts(env, n_simulations)
+        # Среди ходов без посещений (n_simulations меньше числа ходов) выбирать нельзя занятые клетки
+        counts[env.board.ravel() != 0] = -1
+        return int(np.argmax(counts))
+
+
+def policy_mcts_parallel(policy_crosses=None, policy_naughts=None, n_simulations=100, n_workers=None, mode='root', c=1.0, capacity=1024,
+                         max_nodes=None, reroot_each_move=False):
+    '''Стратегия по ParallelMCTS. Процессы работают, пока жива стратегия: strategy.close()
+    останавливает их сразу, иначе они останавливаются, когда стратегия удаляется сборщиком мусора'''
+    mcts = ParallelMCTS(n_workers=n_workers, mode=mode, c=c, capacity=capacity, policy_crosses=policy_crosses, policy_naughts=policy_naughts,
+                        max_nodes=max_nodes, reroot_each_move=reroot_each_move)
+    def strategy(env):
+        return mcts(env, n_simulations=n_simulations)
+    strategy.mcts = mcts
+    strategy.close = mcts.close
+    return strategy
+
+
+class BatchedEvaluator:
+    '''Очередь оценки листьев: объединяет запросы из нескольких потоков (параллельных поисков или партий)
+    в один вызов evaluate(boards, turns, masks) -> (priors, values). Батч считается, когда набралось
+    batch_size позиций или первый ждущий запрос ждет дольше timeout секунд. Вызов блокирует поток до
+    получения своих оценок, сеть считает поток, который собрал батч (torch при этом отпускает GIL)'''
+    def __init__(self, evaluate, batch_size=256, timeout=0.005):
+        self.evaluate = evaluate
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.pending = []
+        self.n_pending = 0
+
+    def run(self, batch):
+        sizes = [len(request['turns']) for request in batch]
+        try:
+            priors, values = self.evaluate(
+                np.concatenate([request['boards'] for request in batch]),
+                np.concatenate([request['turns'] for request in batch]),
+                np.concatenate([request['masks'] for request in batch]),
+            )
+            bounds = np.cumsum(sizes)[:-1]
+            outputs = zip(np.split(priors, bounds), np.split(values, bounds))
+        except Exception as error:
+            outputs = [error] * len(batch)
+        for request, output in zip(batch, outputs):
+            request['outputs'] = output
+
+    def __call__(self, boards, turns, masks):
+        request = {'boards': np.asarray(boards), 'turns': np.asarray(turns), 'masks': np.asarray(masks), 'taken': False, 'outputs': None}
+        with self.condition:
+            self.pending.append(request)
+            self.n_pending += len(request['turns'])
+            deadline = time.monotonic() + self.timeout
+            while request['outputs'] is None:
+                remaining = deadline - time.monotonic()
+                # Запрос уже забрал в батч другой поток -- ждем результата
+                if not request['taken'] and (self.n_pending >= self.batch_size or remaining <= 0):
+                    batch, self.pending, self.n_pending = self.pending, [], 0
+                    for other in batch:
+                        other['taken'] = True
+                    self.condition.release()
+                    try:
+                        self.run(batch)
+                    finally:
+                        self.condition.acquire()
+                    self.condition.notify_all()
+                else:
+                    self.condition.wait(None if request['taken'] else remaining)
+        if isinstance(request['outputs'], Exception):
+            raise request['outputs']
+        return request['outputs']
+
+
+class PUCTMCTS(ArenaMCTS):
+    '''MCTS в стиле AlphaZero: вместо rollout'ов листья оцениваются функцией
+    evaluate(boards, turns, masks) -> (priors, values), где priors -- вероятности ходов (n, n_rows * n_cols),
+    values -- оценки позиций для игрока, который в них ходит (например, q_evaluator из tic_tac_toe_nn
+    или BatchedEvaluator поверх него для нескольких партий в потоках). Ход выбирается по PUCT:
+    Q + c * P * sqrt(N) / (1 + n). За раунд выбирается leaves_per_batch листьев с виртуальным
+    проигрышем на путях, и все они оцениваются одним вызовом evaluate'''
+    def __init__(self, evaluate, c=1.5, leaves_per_batch=8, virtual_loss=1.0, capacity=1024, max_nodes=None, reroot_each_move=False):
+        super().__init__(c=c, capacity=capacity, max_nodes=max_nodes, reroot_each_move=reroot_each_move)
+        self.evaluate = evaluate
+        self.leaves_per_batch = leaves_per_batch
+        self.virtual_loss = virtual_loss
+
+    def reset(self):
+        super().reset()
+        # Для узла уже получены priors ходов
+        self.node_evaluated = np.zeros(self.capacity, dtype=bool)
+
+    def add_node(self, env, outcome=None):
+        node, created = super().add_node(env, outcome)
+        if created:
+            self.node_evaluated[node] = False
+        return node, created
+
+    def puct(self, node):
+        edges = self.edges(node)
+        visits = self.edge_visits[edges]
+        q = np.divide(self.edge_value[edges], visits, out=np.zeros(len(visits)), where=visits > 0)
+        return q + self.c * self.edge_prior[edges] * np.sqrt(max(self.node_visits[node], 1.0)) / (1 + visits)
+
+    def score(self, node):
+        return self.puct(node)
+
+    def expand(self, nodes, boards, turns, masks):
+        # Оценка листьев одним вызовом evaluate: записываем priors ходов, возвращаем оценки позиций
+        priors, values = self.evaluate(np.array(boards), np.array(turns), np.array(masks))
+        for node, prior in zip(nodes, priors):
+            edges = self.edges(node)
+            prior = prior[self.edge_action[edges]]
+            self.edge_prior[edges] = prior / prior.sum() if prior.sum() > 0 else 1.0 / len(prior)
+            self.node_evaluated[node] = True
+        return values
+
+    def search(self, env, n_simulations=100):
+        env = env.clone()
+        if self.reroot_each_move:
+            self.reroot(env)
+        root, _ = self.add_node(env)
+        if not self.node_evaluated[root] and np.isnan(self.node_outcome[root]):
+            self.expand([root], [env.board.copy()], [env.curTurn], [env.board.ravel() == 0])
+
+        n_done = 0
+        while n_done < n_simulations:
+            n_leaves = min(self.leaves_per_batch, n_simulations - n_done)
+            self.collect(env, n_leaves)
+            paths, leaves, inputs = [], [], []
+            for _ in range(n_leaves):
+                nodes, edges, leaf = self.select(env)
+                self.add_virtual_loss(nodes, edges, self.virtual_loss)
+                paths.append((nodes, edges, leaf))
+                if np.isnan(self.node_outcome[leaf]) and not self.node_evaluated[leaf] and leaf not in leaves:
+                    leaves.append(leaf)
+                    inputs.append((env.board.copy(), env.curTurn, env.board.ravel() == 0))
+                for _ in edges:
+                    env.pop()
+
+            values = dict(zip(leaves, self.expand(leaves, *zip(*inputs)))) if leaves else {}
+            for nodes, edges, leaf in paths:
+                self.add_virtual_loss(nodes, edges, -self.virtual_loss)
+                # Оценка сети -- для ходящего в листе, в backup нужна с точки зрения крестиков
+                value = self.node_outcome[leaf] if leaf not in values else values[leaf] * self.node_turn[leaf]
+                self.backup(nodes, edges, value)
+            n_done += len(paths)
+        return self.index[env.getState()]
+
+
+def policy_mcts_puct(evaluate, n_simulations=100, c=1.5, leaves_per_batch=8, capacity=1024, max_nodes=None, reroot_each_move=False):
+    '''Стратегия по PUCTMCTS'''
+    mcts = PUCTMCTS(evaluate, c=c, leaves_per_batch=leaves_per_batch, capacity=capacity, max_nodes=max_nodes, reroot_each_move=reroot_each_move)
+    def strategy(env):
+        return mcts(env, n_simulations=n_simulations)
+    return strategy
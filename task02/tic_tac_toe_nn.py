@@ -0,0 +1,82 @@
+import numpy as np
+import torch
+from gym.utils import seeding
+
+from tic_tac_toe import TicTacToeVectorEnv
+
+
+def policy_random_batch(seed=None):
+    '''Случайная стратегия для батча досок: strategy(boards, masks) -> номера свободных клеток'''
+    np_random, _ = seeding.np_random(seed)
+    def strategy(boards, masks):
+        scores = np_random.uniform(size=masks.shape)
+        scores[~masks] = -1.0
+        return np.argmax(scores, axis=1)
+    return strategy
+
+
+def policy_nn_batch(model, eps=0.0):
+    '''Стратегия по предсказаниям сети для батча досок: strategy(boards, masks) -> номера клеток
+    boards -- доски (n, n_rows, n_cols), masks -- свободные клетки (n, n_rows * n_cols).
+    Один проход сети на весь батч, маскирование и eps-жадный выбор делаются на тензорах'''
+    device = next(model.parameters()).device
+    def strategy(boards, masks):
+        with torch.inference_mode():
+            states = torch.as_tensor(boards, dtype=torch.float32, device=device).unsqueeze(1)
+            masks = torch.as_tensor(masks, device=device)
+            # Недоступные действия не выбираются
+            q = model(states).masked_fill(~masks, -np.inf)
+            actions = q.argmax(1)
+            if eps > 0:
+                # Случайное доступное действие -- максимум случайных оценок по свободным клеткам
+                random_actions = torch.rand(q.shape, device=device).masked_fill(~masks, -1.0).argmax(1)
+                explore = torch.rand(len(actions), device=device) <= eps
+                actions = torch.where(explore, random_actions, actions)
+            return actions.cpu().numpy()
+    return strategy
+
+
+def q_evaluator(model_crosses, model_naughts=None, temperature=0.25):
+    '''Оценка листьев для PUCTMCTS по Q-сетям сторон (Network, DuelingNetwork, ...):
+    evaluate(boards, turns, masks) -> (priors, values). Оценка позиции -- максимум Q по свободным
+    клеткам, priors -- softmax(Q / temperature) по свободным клеткам. Позиции каждой стороны считаются
+    одним проходом своей сети'''
+    models = {1: model_crosses, -1: model_naughts or model_crosses}
+    device = next(model_crosses.parameters()).device
+    def evaluate(boards, turns, masks):
+        q = np.zeros(masks.shape, dtype=np.float32)
+        with torch.inference_mode():
+            for side, model in models.items():
+                if np.any(turns == side):
+                    states = torch.as_tensor(boards[turns == side], dtype=torch.float32, device=device).unsqueeze(1)
+                    q[turns == side] = model(states).cpu().numpy()
+        q[~masks] = -np.inf
+        values = q.max(axis=1)
+        priors = np.exp((q - values[:, None]) / temperature)
+        return priors / priors.sum(axis=1, keepdims=True), values
+    return evaluate
+
+
+def calculate_reward_by_policies_batch(policy_crosses, policy_naughts, n_rows=3, n_cols=3, n_win=3, num_experiments=10000, random_state=None):
+    '''Аналог calculate_reward_by_policies для стратегий на батчах: все num_experiments партий
+    играются одновременно на TicTacToeVectorEnv, на каждом ходу стратегия вызывается один раз
+    для всех незаконченных партий. Возвращает средний доход крестиков и ноликов'''
+    env = TicTacToeVectorEnv(num_experiments, n_rows, n_cols, n_win)
+    env.seed(random_state)
+
+    policies = {1: policy_crosses, -1: policy_naughts}
+    rewards = np.zeros(num_experiments)
+    active = np.ones(num_experiments, dtype=bool)
+    turn = 1
+    while active.any():
+        masks = env.getEmptyMask()
+        # Закончившиеся партии начинаются заново, их ходы не учитываем
+        actions = np.argmax(masks, axis=1)
+        actions[active] = policies[turn](env.boards[active], masks[active])
+        _, reward, done, _ = env.step(actions)
+
+        # Запоминаем результат партий, которые закончились на этом ходу
+        rewards[active & done] = reward[active & done]
+        active &= ~done
+        turn = -turn
+    return (float(rewards.mean()), -float(rewards.mean()))
@@ -0,0 +1,178 @@
+import numpy as np
+import torch
+from gym.utils import seeding
+
+
+class ArrayReplayMemory:
+    '''Память опыта в заранее выделенных массивах (аналог ReplayMemory из ноутбука)
+    Хранит доски состояний и следующих состояний, действия, награды, флаги конца партии и маски
+    свободных клеток следующего состояния. Запись -- O(1) по кругу, батч собирается индексированием
+    массивов без цикла по примерам и сразу возвращается torch тензорами (через from_numpy). Доски
+    хранятся в float32, как их принимает сеть, чтобы батч собирался одним индексированием без приведения типа.
+    filename -- префикс файлов для хранения массивов на диске (np.memmap) при больших capacity'''
+    def __init__(self, capacity, n_rows=3, n_cols=3, filename=None):
+        self.capacity = capacity
+        self.n_rows, self.n_cols = n_rows, n_cols
+        self.position = 0
+        self.size = 0
+
+        def allocate(name, shape, dtype):
+            if filename is None:
+                return np.zeros((capacity,) + shape, dtype=dtype)
+            return np.lib.format.open_memmap(f'{filename}_{name}.npy', mode='w+', dtype=dtype, shape=(capacity,) + shape)
+
+        self.states = allocate('states', (n_rows, n_cols), np.float32)
+        self.actions = allocate('actions', (), np.int64)
+        self.rewards = allocate('rewards', (), np.float32)
+        self.next_states = allocate('next_states', (n_rows, n_cols), np.float32)
+        self.dones = allocate('dones', (), bool)
+        self.masks = allocate('masks', (n_rows * n_cols,), bool)
+        self.seed()
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def store(self, exptuple):
+        # exptuple -- (state, action, reward, next_state[, done[, mask]]), доски -- тензоры или массивы,
+        # маска по умолчанию -- свободные клетки next_state
+        state, action, reward, next_state = exptuple[:4]
+        done = exptuple[4] if len(exptuple) > 4 else False
+        next_state = np.asarray(next_state).reshape(self.n_rows, self.n_cols)
+        mask = exptuple[5] if len(exptuple) > 5 else next_state.ravel() == 0
+
+        i = self.position
+        self.states[i] = np.asarray(state).reshape(self.n_rows, self.n_cols)
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.masks[i] = mask
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def store_batch(self, states, actions, rewards, next_states, dones, masks=None):
+        # Запись батча переходов (например, с TicTacToeVectorEnv) одним присваиванием
+        n = len(actions)
+        index = (self.position + np.arange(n)) % self.capacity
+        next_states = np.asarray(next_states).reshape(n, self.n_rows, self.n_cols)
+        self.states[index] = np.asarray(states).reshape(n, self.n_rows, self.n_cols)
+        self.actions[index] = actions
+        self.rewards[index] = rewards
+        self.next_states[index] = next_states
+        self.dones[index] = dones
+        self.masks[index] = next_states.reshape(n, -1) == 0 if masks is None else masks
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def gather(self, index):
+        # Батч по индексам: состояния (B, 1, n_rows, n_cols), действия (B, 1), награды, следующие
+        # состояния, флаги конца партии и маски свободных клеток следующего состояния
+        return (
+            torch.from_numpy(self.states[index]).unsqueeze(1),
+            torch.from_numpy(self.actions[index]).unsqueeze(1),
+            torch.from_numpy(self.rewards[index]),
+            torch.from_numpy(self.next_states[index]).unsqueeze(1),
+            torch.from_numpy(self.dones[index]),
+            torch.from_numpy(self.masks[index]),
+        )
+
+    def sample(self, batch_size):
+        # Индексы выбираются без возвращения (как random.sample), кроме батча возвращаются веса
+        # примеров (все равны 1) и индексы для update_priorities
+        if batch_size > self.size:
+            raise ValueError(f'batch_size {batch_size} больше числа примеров в памяти {self.size}')
+        if 2 * batch_size > self.size:
+            index = self.np_random.permutation(self.size)[:batch_size]
+        else:
+            # RandomState.choice(replace=False) перемешивает всю память, поэтому берем randint и
+            # перевыбираем повторы -- время зависит от batch_size, а не от размера памяти
+            index = self.np_random.randint(self.size, size=batch_size)
+            while True:
+                _, first = np.unique(index, return_index=True)
+                if len(first) == batch_size:
+                    break
+                repeated = np.ones(batch_size, dtype=bool)
+                repeated[first] = False
+                index[repeated] = self.np_random.randint(self.size, size=repeated.sum())
+        return self.gather(index) + (torch.ones(batch_size), index)
+
+    def update_priorities(self, index, td_errors):
+        # Равномерная память приоритеты не хранит
+        pass
+
+    def __len__(self):
+        return self.size
+
+
+class SumTree:
+    '''Дерево сумм в массиве: листья -- приоритеты, в каждом узле сумма потомков (корень -- tree[1])
+    Обновление приоритетов и поиск по префиксной сумме -- O(log N) и сразу для массива индексов'''
+    def __init__(self, capacity):
+        # Число листьев -- степень двойки, чтобы все листья были на одной глубине
+        self.n_leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.tree = np.zeros(2 * self.n_leaves)
+
+    def total(self):
+        return self.tree[1]
+
+    def priorities(self, index):
+        return self.tree[np.asarray(index) + self.n_leaves]
+
+    def update(self, index, priorities):
+        nodes = np.asarray(index) + self.n_leaves
+        self.tree[nodes] = priorities
+        # Пересчитываем суммы уровень за уровнем до корня
+        nodes = np.unique(nodes // 2)
+        while len(nodes):
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes[nodes > 1] // 2)
+
+    def find(self, values):
+        # Индексы листьев, на которые приходятся префиксные суммы values
+        values = np.array(values, dtype=float)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.n_leaves:
+            left = self.tree[2 * nodes]
+            right = values > left
+            values -= left * right
+            nodes = 2 * nodes + right
+        return nodes - self.n_leaves
+
+
+class PrioritizedReplayMemory(ArrayReplayMemory):
+    '''Приоритетная память опыта (Prioritized Experience Replay) на дереве сумм
+    Пример выбирается с вероятностью p^alpha / sum(p^alpha), где p = |TD ошибка| + eps, новые
+    примеры получают максимальный приоритет. Веса importance sampling (N * P)^(-beta) нормированы
+    на максимум в батче, beta можно менять по ходу обучения'''
+    def __init__(self, capacity, n_rows=3, n_cols=3, filename=None, alpha=0.6, beta=0.4, eps=1e-3):
+        super().__init__(capacity, n_rows, n_cols, filename)
+        self.alpha, self.beta, self.eps = alpha, beta, eps
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def store(self, exptuple):
+        index = self.position
+        super().store(exptuple)
+        self.tree.update([index], [self.max_priority])
+
+    def store_batch(self, states, actions, rewards, next_states, dones, masks=None):
+        index = (self.position + np.arange(len(actions))) % self.capacity
+        super().store_batch(states, actions, rewards, next_states, dones, masks)
+        self.tree.update(index, np.full(len(index), self.max_priority))
+
+    def sample(self, batch_size):
+        # Стратифицированная выборка: по одному примеру из каждого из batch_size равных отрезков суммы
+        total = self.tree.total()
+        values = (np.arange(batch_size) + self.np_random.uniform(size=batch_size)) * total / batch_size
+        # Из-за округлений поиск может уйти в пустой лист за концом памяти
+        index = np.minimum(self.tree.find(values), self.size - 1)
+
+        weights = (self.size * self.tree.priorities(index) / total) ** -self.beta
+        weights /= weights.max()
+        return self.gather(index) + (torch.from_numpy(weights.astype(np.float32)), index)
+
+    def update_priorities(self, index, td_errors):
+        priorities = (np.abs(td_errors) + self.eps) ** self.alpha
+        self.tree.update(index, priorities)
+        self.max_priority = max(self.max_priority, priorities.max())
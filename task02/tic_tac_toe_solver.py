@@ -0,0 +1,235 @@
+import os
+
+import numpy as np
+
+from tic_tac_toe import TicTacToe
+
+# Тип записи таблицы: точная оценка, нижняя или верхняя граница (отсечение alpha-beta)
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TicTacToeSolver:
+    '''Точное решение TicTacToe(n_rows, n_cols, n_win): negamax с alpha-beta отсечением
+    Оценка позиции -- для игрока, который в ней ходит: n_empty + 1 при победе, когда после победного
+    хода остается n_empty пустых клеток (быстрая победа лучше), 0 при ничьей, минус оценка при
+    поражении. Ходы перебираются в порядке: победный ход, блокировка победного хода противника
+    (если они есть, остальные ходы можно не смотреть), затем клетки с большим числом линий.
+    Таблица транспозиций -- по каноническому Zobrist хэшу (минимум по симметриям доски).
+    filename -- префикс файлов таблицы (например, 'solver_3x3_3'): если они есть, таблица
+    открывается через np.memmap без пересчета, иначе решается пустая доска и таблица сохраняется
+    (ключи -- 64-битные хэши, в файле uint64)'''
+    def __init__(self, n_rows=3, n_cols=3, n_win=3, filename=None):
+        self.n_rows, self.n_cols, self.n_win = n_rows, n_cols, n_win
+        self.n_cells = n_rows * n_cols
+        self.env = TicTacToe(n_rows, n_cols, n_win, track_symmetries=True)
+        # Клетки в порядке убывания числа линий через них
+        self.cell_order = sorted(range(self.n_cells), key=lambda cell: -len(self.env.cell_lines[cell]))
+        # Новые записи (в памяти) и сохраненные (отсортированные ключи с оценками и типами записей)
+        self.table = {}
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.values = np.zeros(0, dtype=np.int8)
+        self.flags = np.zeros(0, dtype=np.int8)
+
+        self.filename = filename
+        if filename is not None and os.path.exists(f'{filename}_keys.npy'):
+            self.load(filename)
+        else:
+            self.value(self.env)
+            if filename is not None:
+                self.save(filename)
+
+    def load(self, filename):
+        self.keys = np.load(f'{filename}_keys.npy', mmap_mode='r')
+        self.values = np.load(f'{filename}_values.npy', mmap_mode='r')
+        self.flags = np.load(f'{filename}_flags.npy', mmap_mode='r')
+
+    def save(self, filename=None):
+        # Объединяем новые записи с сохраненными (новые точнее) и перезаписываем файлы
+        filename = filename or self.filename
+        keys = np.concatenate([np.fromiter(self.table.keys(), dtype=np.uint64, count=len(self.table)), self.keys])
+        values = np.concatenate([np.array([value for value, _ in self.table.values()], dtype=np.int8), self.values])
+        flags = np.concatenate([np.array([flag for _, flag in self.table.values()], dtype=np.int8), self.flags])
+        keys, index = np.unique(keys, return_index=True)
+        for name, array in (('keys', keys), ('values', values[index]), ('flags', flags[index])):
+            # Через временный файл: открытый memmap старой таблицы остается корректным
+            np.save(f'{filename}_{name}.tmp.npy', array)
+            os.replace(f'{filename}_{name}.tmp.npy', f'{filename}_{name}.npy')
+        self.table = {}
+        self.load(filename)
+
+    def lookup(self, key):
+        entry = self.table.get(key)
+        if entry is None and len(self.keys):
+            i = np.searchsorted(self.keys, np.uint64(key))
+            if i < len(self.keys) and self.keys[i] == key:
+                entry = (int(self.values[i]), int(self.flags[i]))
+        return entry
+
+    def ordered_moves(self, player):
+        env = self.env
+        occupied = env.bitboards[1] | env.bitboards[-1]
+        own, other = env.line_counts[player], env.line_counts[-player]
+        moves, blocks = [], []
+        for cell in self.cell_order:
+            if (occupied >> cell) & 1:
+                continue
+            lines = env.cell_lines[cell]
+            if any(own[k] == self.n_win - 1 and other[k] == 0 for k in lines):
+                return [cell]
+            if any(other[k] == self.n_win - 1 and own[k] == 0 for k in lines):
+                blocks.append(cell)
+            moves.append(cell)
+        # Если не закрыть линию противника, он выиграет следующим ходом при любом нашем ходе
+        return blocks or moves
+
+    def negamax(self, alpha, beta):
+        # Оценка позиции self.env для ходящего игрока. Ходы делаются через makeMove / unmakeMove
+        # (без push / pop), победитель восстанавливается вручную
+        env = self.env
+        alpha_orig = alpha
+        key = min(env.symmetryHashes)
+        entry = self.lookup(key)
+        if entry is not None:
+            value, flag = entry
+            if flag == EXACT:
+                return value
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value
+        # Лучше победы текущим ходом ничего нет
+        beta = min(beta, env.n_empty)
+
+        player, winner = env.curTurn, env.winner
+        best = -self.n_cells - 1
+        for cell in self.ordered_moves(player):
+            i, j = divmod(cell, self.n_cols)
+            env.makeMove(player, i, j)
+            if env.winner == player:
+                value = env.n_empty + 1
+            elif env.n_empty == 0:
+                value = 0
+            else:
+                env.curTurn = -player
+                value = -self.negamax(-beta, -alpha)
+                env.curTurn = player
+            env.unmakeMove(player, i, j)
+            env.winner = winner
+
+            best = max(best, value)
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        flag = UPPER if best <= alpha_orig else (LOWER if best >= beta else EXACT)
+        self.table[key] = (best, flag)
+        return best
+
+    def value(self, env):
+        # Точная оценка позиции env для игрока, который в ней ходит
+        if env.winner is not None or env.n_empty == 0:
+            raise ValueError('Партия уже закончена')
+        self.env = env.clone()
+        if not self.env.track_symmetries:
+            self.env.startTrackingSymmetries()
+        return self.negamax(-self.n_cells - 1, self.n_cells + 1)
+
+    def action_values(self, env):
+        # Точные оценки ходов в позиции env для ходящего игрока (nan для занятых клеток)
+        values = np.full(self.n_cells, np.nan)
+        env = env.clone()
+        for action in env.getEmptyInts():
+            _, reward, done, _ = env.push_int(action)
+            if done:
+                values[action] = env.n_empty + 1 if reward != 0 else 0
+            else:
+                values[action] = -self.value(env)
+            env.pop()
+        return values
+
+    def best_actions(self, env):
+        values = self.action_values(env)
+        return np.flatnonzero(values == np.nanmax(values))
+
+
+def policy_solver(solver):
+    '''Оптимальная стратегия по решателю (случайный ход среди лучших)'''
+    def strategy(env):
+        actions = solver.best_actions(env)
+        return actions[env.np_random.randint(len(actions))]
+    return strategy
+
+
+def optimal_move_rate(solver, policy, crosses=True):
+    '''Доля позиций, в которых стратегия делает ход, не ухудшающий теоретический результат партии
+    (победа / ничья / поражение при идеальной игре). Перебираются все достижимые незаконченные позиции,
+    где ходит сторона стратегии (policy вызывается один раз в каждой позиции)'''
+    env = TicTacToe(solver.n_rows, solver.n_cols, solver.n_win)
+    side = 1 if crosses else -1
+    seen, n_positions, n_optimal = set(), 0, 0
+
+    def visit():
+        nonlocal n_positions, n_optimal
+        if env.zobristHash in seen:
+            return
+        seen.add(env.zobristHash)
+        if env.curTurn == side:
+            values = solver.action_values(env)
+            n_positions += 1
+            n_optimal += np.sign(values[policy(env)]) == np.sign(np.nanmax(values))
+        for action in env.getEmptyInts():
+            _, _, done, _ = env.push_int(action)
+            if not done:
+                visit()
+            env.pop()
+
+    visit()
+    return n_optimal / n_positions
+
+
+def calculate_reward_vs_random(policy, crosses=True, n_rows=3, n_cols=3, n_win=3, deterministic=None, num_experiments=10000, random_state=None):
+    '''Средний доход крестиков и ноликов (как в calculate_reward_by_policies), когда policy играет
+    за крестиков (crosses=True) или ноликов против случайной стратегии. Для детерминированной
+    стратегии (deterministic=True, например policy_nn(model, 0.0)) ожидание считается точно рекурсией
+    по всем ходам случайного соперника с кэшем по getState, иначе доход оценивается по
+    num_experiments сыгранным партиям. deterministic=None -- берется атрибут policy.deterministic
+    (False, если его нет): по ходам стратегию не отличить от стохастической с малым eps'''
+    env = TicTacToe(n_rows, n_cols, n_win)
+    env.seed(random_state)
+    side = 1 if crosses else -1
+    if deterministic is None:
+        deterministic = getattr(policy, 'deterministic', False)
+    memo = {}
+
+    def expected():
+        # Ожидаемый доход крестиков из текущей позиции
+        key = env.getState()
+        if key in memo:
+            return memo[key]
+        if env.curTurn == side:
+            actions = [policy(env)]
+        else:
+            actions = env.getEmptyInts()
+        total = 0.0
+        for action in actions:
+            _, reward, done, _ = env.push_int(action)
+            total += reward if done else expected()
+            env.pop()
+        memo[key] = total / len(actions)
+        return memo[key]
+
+    def sample():
+        total = 0.0
+        for _ in range(num_experiments):
+            env.reset()
+            done = False
+            while not done:
+                action = policy(env) if env.curTurn == side else env.randomIntAction()
+                _, reward, done, _ = env.step_int(action)
+            total += reward
+        return total / num_experiments
+
+    reward = expected() if deterministic else sample()
+    return (reward, -reward)